@@ -1,68 +1,909 @@
 #!/usr/bin/env python
+import fnmatch
+import heapq
+import io
+import json
 import multiprocessing
+import multiprocessing.connection
+import multiprocessing.pool
 import os
 import pathlib
+import queue
+import resource
+import signal
 import subprocess
 import sys
 import threading
+import time
+import zipfile
+from contextlib import contextmanager
 
+import selector
+import solcache
 import solver
+import watcher
 
 
 def trace(*args, **kwargs):
     print(*args, file=sys.stderr, flush=True, **kwargs)
 
 
-def pworker(pargs):
-    (infile, outfile, program, timeout, verbose) = pargs
+@contextmanager
+def open_problem(infile):
+    if isinstance(infile, tuple):
+        fn, member = infile
+        with zipfile.ZipFile(fn) as z, z.open(member) as f:
+            yield io.TextIOWrapper(f, encoding='utf8')
+    else:
+        with open(infile) as f:
+            yield f
 
-    def tworker(infile, outfile):
-        if verbose: trace(infile)
-        w = solver.Worker(program)
-        return w.solve(infile, outfile)
 
-    t = threading.Thread(target=tworker, args=(infile, outfile))
+def problem_name(infile):
+    if isinstance(infile, tuple):
+        return ':'.join(infile)
+    return infile
+
+
+def problems(spec):
+    if zipfile.is_zipfile(spec):
+        with zipfile.ZipFile(spec) as z:
+            names = z.namelist()
+        for member in sorted(names):
+            fn = pathlib.PurePosixPath(member)
+            if fn.match('prob-*.desc'):
+                yield fn, (spec, member)
+    else:
+        for fn in sorted(pathlib.Path(spec).glob('**/prob-*.desc')):
+            yield fn, str(fn)
+
+
+def problem_size(infile):
+    with open_problem(infile) as f:
+        mine = f.read().split('#', 1)[0]
+    pts = solver.parse_points(mine)
+    return max(x for x, y in pts) * max(y for x, y in pts)
+
+
+def run_job(pargs, res, parsed=None, state=None):
+    (infile, outfile, program, timeout, verbose, tracefn, optimize, warm, cache, history, portfolio) = pargs
+    if verbose: trace(problem_name(infile))
+    w = solver.Worker(program, trace=tracefn, optimize=optimize, warm=warm, cache=cache, history=history, portfolio=portfolio)
+    if state is not None:
+        state['worker'] = w
+    try:
+        with open_problem(infile) as f:
+            w.solve(f, outfile, parsed=parsed)
+    except MemoryError:
+        trace(f'{problem_name(infile)}: out of memory')
+        res['status'] = 'oom'
+        return
+    except Exception as e:
+        trace(f'{problem_name(infile)}: {e!r}')
+        return
+    res.update(status=w.status, length=w.length)
+    if w.chosen:
+        res['program'] = w.chosen
+
+
+def pworker(pargs, report=None):
+    (infile, outfile, program, timeout, verbose) = pargs[:5]
+    res = dict(name=problem_name(infile), status='error', length=None)
+
+    state = dict()
+    start = time.perf_counter()
+    t = threading.Thread(target=run_job, args=(pargs, res, None, state))
     t.start()
     t.join(timeout=timeout)
     if t.is_alive():
         if verbose: trace(f'timed out ({timeout} sec)')
         if not os.path.isfile(outfile):
             with open(outfile, 'w') as f: pass
+        res['status'] = 'timeout'
+        if 'worker' in state:
+            state['worker'].tracer.end(status='timeout', timeout=timeout)
+        if report:
+            # the timeout is reported now, the calling pool thread stays taken until the solve really ends
+            report(dict(res, time=time.perf_counter() - start))
+            t.join()
+            return None
+    res['time'] = time.perf_counter() - start
+    return res
+
+
+def parse_problem(infile):
+    with open_problem(infile) as f:
+        board = solver.Board.load(f)
+    return board, board.gen_grid()
+
+
+def pchild(job, limit, conn):
+    if limit:
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    # each child parses its own problem, side by side with the others, and not at all on a cache hit
+    res = pworker(job)
+    res['rss'] = solver.peak_rss()
+    conn.send(res)
+    conn.close()
+    # do not wait for a timed out solver thread
+    os._exit(0)
+
+
+def total_memory():
+    return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+
+
+def available_memory():
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+
+
+# address space a solver process maps beyond its resident set: interpreter, libraries, thread arenas
+_vm_overhead = 512 * 2**20
+# a solver process may outgrow its memory estimate this many times before it hits its limit
+_mem_headroom = 2
+
+
+class MemoryModel:
+    # peak RSS of a solver process as base + per_cell * map area, refit from finished runs
+    def __init__(self, base=64 * 2**20, per_cell=1024, small=10000):
+        self.base = base
+        self.per_cell = per_cell
+        self.small = small
+        self.bases = list()
+        self.cells = list()
+
+    def estimate(self, size):
+        return self.base + self.per_cell * size
+
+    def observe(self, size, rss):
+        if not rss: return
+        if size < self.small:
+            self.bases.append(rss)
+            if len(self.bases) >= 3:
+                self.base = int(max(self.bases) * 1.1)
+        else:
+            self.cells.append((size, rss))
+        ratios = [(rss - self.base) / size for size, rss in self.cells]
+        if len(ratios) >= 3:
+            self.per_cell = max(64, max(ratios) * 1.25)
+        elif ratios:
+            self.per_cell = max(self.per_cell, max(ratios) * 1.25)
+
+
+class TimeModel:
+    # solve time as base + per_cell * map area, both refit from runs that solved to the end;
+    # timed out runs and ones cut short by a bound say nothing about the full time, they are left out
+    def __init__(self, base=1.0, per_cell=1e-3):
+        self.base = base
+        self.per_cell = per_cell
+        self.samples = list()
+
+    def estimate(self, size):
+        return self.base + self.per_cell * size
+
+    def observe(self, size, t, status):
+        if status != 'solved' or not size or t is None: return
+        self.samples.append((size, t))
+        if len(self.samples) < 3: return
+        # least squares line through the samples
+        n = len(self.samples)
+        mx = sum(x for x, _ in self.samples) / n
+        my = sum(y for _, y in self.samples) / n
+        sxx = sum((x - mx) ** 2 for x, _ in self.samples)
+        if not sxx: return
+        sxy = sum((x - mx) * (y - my) for x, y in self.samples)
+        self.per_cell = max(1e-6, sxy / sxx)
+        self.base = max(0.0, my - self.per_cell * mx)
+
+    def load(self, fn, program):
+        # seed from the summary of an earlier run of the same program
+        try:
+            with open(fn) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        if data.get('meta', dict()).get('program') != program: return
+        for x in data.get('problems', list()):
+            self.observe(x.get('size'), x.get('time'), x.get('status'))
+
+
+class TimeBudget:
+    # splits the wall-clock time left between unfinished problems in proportion to their estimated solve time,
+    # whatever early finishers leave goes to the running and remaining ones
+    def __init__(self, total, slots, cap=None, model=None, headroom=2):
+        self.deadline = time.monotonic() + total
+        self.slots = slots
+        self.cap = cap
+        self.model = model or TimeModel()
+        self.headroom = headroom
+
+    def left(self):
+        return self.deadline - time.monotonic()
+
+    def factor(self, pending, running):
+        now = time.monotonic()
+        demand = sum(self.model.estimate(size) for size in pending)
+        for size, start in running:
+            est = self.model.estimate(size)
+            demand += max(est - (now - start), est * 0.1)
+        if not demand:
+            return self.headroom
+        return max(self.headroom, self.slots * self.left() / demand)
+
+    def until(self, start, size, factor):
+        t = self.model.estimate(size) * factor
+        if self.cap:
+            t = min(t, self.cap)
+        return min(start + t, self.deadline)
+
+
+class Prefetch:
+    # parses and rasterizes problems on a background thread, a few jobs ahead of the solver threads:
+    # parsing holds the GIL, the native solves do not
+    def __init__(self, jobs, depth):
+        self.parsed = dict()
+        self.taken = set()
+        self.busy = None
+        self.slots = threading.Semaphore(depth)
+        self.cond = threading.Condition()
+        self.closed = False
+        threading.Thread(target=self.run, args=(list(jobs),), daemon=True).start()
+
+    def run(self, jobs):
+        for job in jobs:
+            name = problem_name(job[0])
+            self.slots.acquire()
+            with self.cond:
+                if self.closed:
+                    return
+                if name in self.taken:
+                    self.slots.release()
+                    continue
+                self.busy = name
+            try:
+                x = parse_problem(job[0])
+            except Exception:
+                x = None
+            with self.cond:
+                self.busy = None
+                self.cond.notify_all()
+                if self.closed:
+                    return
+                self.parsed[name] = x
+
+    def take(self, job):
+        name = problem_name(job[0])
+        with self.cond:
+            # cheaper to wait for the one being parsed than to parse it again
+            while self.busy == name:
+                self.cond.wait()
+            if name not in self.parsed:
+                self.taken.add(name)
+                return None
+            x = self.parsed.pop(name)
+        self.slots.release()
+        return x
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.parsed.clear()
+        self.slots.release()
+
+
+class Scheduler:
+    # admits jobs while their estimated memory fits in the budget and in what the system has left
+    def __init__(self, sizes, budget=None, jobs=None, worker_mem=None, timeout=None, clock=None):
+        self.sizes = sizes
+        self.model = MemoryModel()
+        self.budget = budget or int(total_memory() * 0.8)
+        self.max_jobs = jobs or os.cpu_count()
+        self.worker_mem = worker_mem or self.budget + _vm_overhead
+        self.timeout = timeout
+        self.clock = clock
+        self.running = dict()
+        self.retried = set()
+        self.prefetch = None
+
+    def factor(self, pending):
+        running = [(self.sizes[problem_name(x[1][0])], x[3]) for x in self.running.values()]
+        return self.clock.factor([self.sizes[problem_name(x[0])] for x in pending], running)
+
+    def extend(self):
+        # hand time left over by early finishers to the running jobs
+        f = self.factor(self.pending)
+        for rx, (p, job, est, start, deadline) in self.running.items():
+            t = self.clock.until(start, self.sizes[problem_name(job[0])], f)
+            self.running[rx] = (p, job, est, start, max(deadline, t))
+
+    def estimate(self, job):
+        return self.model.estimate(self.sizes[problem_name(job[0])])
+
+    def limit(self, job, est):
+        # a job that ran out of its own limit gets one more go with the largest one
+        if problem_name(job[0]) in self.retried:
+            return self.worker_mem
+        return min(_mem_headroom * est + _vm_overhead, self.worker_mem)
+
+    def admit(self, pending):
+        used = sum(x[2] for x in self.running.values())
+        avail = available_memory()
+        if self.clock and self.clock.left() <= 0:
+            return
+        while pending and len(self.running) < self.max_jobs:
+            for n, job in enumerate(pending):
+                est = self.estimate(job)
+                if not self.running:
+                    break
+                if used + est <= self.budget and (avail is None or est <= avail * 0.9):
+                    break
+            else:
+                return
+            f = self.factor(pending) if self.clock else None
+            del pending[n]
+            rx, tx = multiprocessing.Pipe(duplex=False)
+            p = multiprocessing.Process(target=pchild, args=(job, self.limit(job, est), tx))
+            p.start()
+            tx.close()
+            start = time.monotonic()
+            if self.clock:
+                deadline = self.clock.until(start, self.sizes[problem_name(job[0])], f)
+            else:
+                deadline = start + self.timeout + 30 if self.timeout else None
+            self.running[rx] = (p, job, est, start, deadline)
+            used += est
+            if avail is not None:
+                avail -= est
+
+    def collect(self):
+        if self.clock:
+            self.extend()
+        deadlines = [x[4] for x in self.running.values() if x[4] is not None]
+        wait = max(0, min(deadlines) - time.monotonic()) if deadlines else None
+        ready = multiprocessing.connection.wait(list(self.running), timeout=wait)
+        now = time.monotonic()
+        for rx in list(self.running):
+            p, job, est, start, deadline = self.running[rx]
+            if rx in ready:
+                try:
+                    res = rx.recv()
+                except EOFError:
+                    res = dict(name=problem_name(job[0]), status='crashed', length=None, time=now - start)
+            elif deadline is not None and now >= deadline:
+                p.kill()
+                res = dict(name=problem_name(job[0]), status='timeout', length=None, time=now - start)
+                if not os.path.isfile(job[1]):
+                    with open(job[1], 'w') as f: pass
+            else:
+                continue
+            p.join()
+            rx.close()
+            del self.running[rx]
+            self.model.observe(self.sizes[res['name']], res.get('rss'))
+            if res['status'] in ('oom', 'crashed') and self.limit(job, est) < self.worker_mem:
+                self.retried.add(res['name'])
+                self.pending.insert(0, job)
+                continue
+            if self.clock:
+                self.clock.model.observe(self.sizes[res['name']], res['time'], res['status'])
+            yield res
+
+    def run(self, jobs):
+        self.pending = pending = list(jobs)
+        if self.clock:
+            # most problems solved in the window: cheap ones first
+            pending.sort(key=lambda x: self.sizes[problem_name(x[0])])
+        self.prefetch = self.prefetcher(pending)
+        try:
+            while pending or self.running:
+                if self.clock and self.clock.left() <= 0 and not self.running:
+                    for job in pending:
+                        yield dict(name=problem_name(job[0]), status='skipped', length=None, time=0)
+                    break
+                self.admit(pending)
+                yield from self.collect()
+        finally:
+            if self.prefetch:
+                self.prefetch.close()
+
+    def prefetcher(self, jobs):
+        return None
+
+
+class ThreadScheduler(Scheduler):
+    # one process for all jobs: native solves drop the GIL, so they run side by side on threads
+    # and share the loaded libraries; a solve past its deadline cannot be interrupted, it is abandoned
+    def __init__(self, sizes, budget=None, jobs=None, timeout=None, clock=None):
+        super().__init__(sizes, budget=budget, jobs=jobs, timeout=timeout, clock=clock)
+        self.done = queue.Queue()
+
+    def estimate(self, job):
+        return self.model.estimate(self.sizes[problem_name(job[0])]) - self.model.base
 
+    def prefetcher(self, jobs):
+        return Prefetch(jobs, self.max_jobs)
 
-def main(specdirs, program, targetdir, timeout=None, skip=False, skip_zero=False, verbose=False):
+    def start(self, job):
+        res = dict(name=problem_name(job[0]), status='error', length=None)
+        parsed = self.prefetch.take(job)
+        state = dict()
+
+        def target(start):
+            run_job(job, res, parsed, state)
+            res['time'] = time.perf_counter() - start
+            self.done.put((threading.current_thread(), res))
+
+        t = threading.Thread(target=target, args=(time.perf_counter(),), daemon=True)
+        t.start()
+        return t, state
+
+    def admit(self, pending):
+        used = sum(x[2] for x in self.running.values())
+        if self.clock and self.clock.left() <= 0:
+            return
+        while pending and len(self.running) < self.max_jobs:
+            est = self.estimate(pending[0])
+            if self.running and used + est > self.budget:
+                return
+            f = self.factor(pending) if self.clock else None
+            job = pending.pop(0)
+            start = time.monotonic()
+            if self.clock:
+                deadline = self.clock.until(start, self.sizes[problem_name(job[0])], f)
+            else:
+                deadline = start + self.timeout if self.timeout else None
+            t, state = self.start(job)
+            self.running[t] = (state, job, est, start, deadline)
+            used += est
+
+    def collect(self):
+        if self.clock:
+            self.extend()
+        deadlines = [x[4] for x in self.running.values() if x[4] is not None]
+        wait = max(0, min(deadlines) - time.monotonic()) if deadlines else None
+        done = list()
+        try:
+            done.append(self.done.get(timeout=wait))
+            while True:
+                done.append(self.done.get_nowait())
+        except queue.Empty:
+            pass
+        now = time.monotonic()
+        for t, res in done:
+            if t not in self.running: continue
+            del self.running[t]
+            yield self.observe(res)
+        for t, (state, job, est, start, deadline) in list(self.running.items()):
+            if deadline is not None and now >= deadline:
+                del self.running[t]
+                if 'worker' in state:
+                    state['worker'].tracer.end(status='timeout', timeout=now - start)
+                if not os.path.isfile(job[1]):
+                    with open(job[1], 'w') as f: pass
+                yield self.observe(dict(name=problem_name(job[0]), status='timeout', length=None, time=now - start))
+
+    def observe(self, res):
+        if self.clock:
+            self.clock.model.observe(self.sizes[res['name']], res['time'], res['status'])
+        return res
+
+
+class Progress:
+    def __init__(self, sizes, interval=30):
+        self.sizes = sizes
+        self.total = sum(sizes.values())
+        self.done = 0
+        self.results = list()
+        self.counts = dict()
+        self.start = time.time()
+        self.interval = interval
+        self.last = 0
+        self.live = sys.stderr.isatty()
+
+    def update(self, res):
+        res['size'] = self.sizes[res['name']]
+        self.results.append(res)
+        self.done += res['size']
+        self.counts[res['status']] = self.counts.get(res['status'], 0) + 1
+        now = time.time()
+        if self.live or now - self.last >= self.interval or len(self.results) == len(self.sizes):
+            self.last = now
+            self.show()
+
+    def percentiles(self):
+        ts = sorted(x['time'] for x in self.results)
+        if not ts:
+            return dict()
+        return {f'p{p}': ts[min(len(ts) - 1, int(len(ts) * p / 100))] for p in (50, 90, 99)} | dict(max=ts[-1])
+
+    def eta(self):
+        elapsed = time.time() - self.start
+        if not self.done:
+            return None
+        return elapsed * (self.total - self.done) / self.done
+
+    def status(self):
+        elapsed = time.time() - self.start
+        n = len(self.results)
+        counts = ' '.join(f'{k} {v}' for k, v in sorted(self.counts.items()))
+        pct = ' '.join(f'{k} {v:.1f}s' for k, v in self.percentiles().items())
+        eta = self.eta()
+        eta = f'{int(eta // 3600)}:{int(eta % 3600 // 60):02}:{int(eta % 60):02}' if eta is not None else '?'
+        return f'[{n}/{len(self.sizes)}] {counts} | {n / elapsed * 60:.1f}/min | {pct} | eta {eta}'
+
+    def show(self):
+        if self.live:
+            print('\r\033[K' + self.status(), end='', file=sys.stderr, flush=True)
+        else:
+            trace(self.status())
+
+    def close(self):
+        if self.live and self.results:
+            print(file=sys.stderr)
+
+    def summary(self, **meta):
+        return dict(
+            meta=meta | dict(started=time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(self.start)), elapsed=time.time() - self.start),
+            counts=self.counts,
+            runtime=self.percentiles(),
+            problems=sorted(self.results, key=lambda x: x['name']),
+        )
+
+
+def trace_summary(fn, since=0):
+    stages = dict()
+    status = dict()
+    with open(fn) as f:
+        for line in f:
+            rec = json.loads(line)
+            if rec['ts'] < since: continue
+            status[rec.get('status')] = status.get(rec.get('status'), 0) + 1
+            for name, x in rec['stages'].items():
+                stages.setdefault(name, list()).append(x)
+
+    def pct(xs, p):
+        return xs[min(len(xs) - 1, int(len(xs) * p))]
+
+    trace(f'{"stage":10}{"count":>8}{"total s":>10}{"mean ms":>10}{"p50 ms":>10}{"p95 ms":>10}{"max ms":>10}{"rss MB":>10}')
+    for name, xs in stages.items():
+        ts = sorted(x['time'] for x in xs)
+        rss = max(x['rss'] for x in xs) / 2**20
+        trace(f'{name:10}{len(ts):8}{sum(ts):10.2f}{sum(ts) / len(ts) * 1000:10.1f}'
+            f'{pct(ts, 0.5) * 1000:10.1f}{pct(ts, 0.95) * 1000:10.1f}{ts[-1] * 1000:10.1f}{rss:10.1f}')
+    trace(' '.join(f'{k}: {v}' for k, v in status.items()))
+
+
+def main(specdirs, program, targetdir, timeout=None, skip=False, skip_zero=False, verbose=False, tracefn=None, optimize=True,
+        summary=None, report=30, processes=None, memory=None, worker_mem=None, warm=True, cache=True, walltime=None,
+        history=None, portfolio=2, threads=False):
     def walk():
         for spec in specdirs:
-            for fn in sorted(pathlib.Path(spec).glob('**/prob-*.desc')):
+            for fn, infile in problems(spec):
                 tfn = os.path.join(targetdir, fn.with_suffix('.sol').name)
-                fn = str(fn)
 
                 if skip and os.path.isfile(tfn) and os.path.getsize(tfn):
                     continue
                 if skip_zero and os.path.isfile(tfn) and os.path.getsize(tfn) == 0:
                     continue
 
-                yield (fn, tfn, program, timeout, verbose)
+                # with a budget the scheduler enforces the time limits
+                yield (infile, tfn, program, None if walltime else timeout, verbose, tracefn, optimize, warm, cache, history, portfolio)
+
+    if tracefn:
+        tracefn = os.path.abspath(tracefn)
+    since = time.time()
+
+    jobs = list(walk())
+    progress = Progress({problem_name(x[0]): problem_size(x[0]) for x in jobs}, interval=report)
+
+    if summary is None:
+        summary = os.path.join(targetdir, 'batch-summary.json')
+
+    clock = None
+    if walltime:
+        clock = TimeBudget(walltime, processes or os.cpu_count(), cap=timeout)
+        if summary:
+            clock.model.load(summary, program)
+
+    if program == 'auto':
+        # forked solvers start with the records loaded here and only read what was added since
+        selector.open_history(True).load()
 
-    with multiprocessing.Pool() as pool:
-        for _ in pool.imap_unordered(pworker, walk()):
+    if threads:
+        sched = ThreadScheduler(progress.sizes, budget=memory, jobs=processes, timeout=timeout, clock=clock)
+    else:
+        sched = Scheduler(progress.sizes, budget=memory, jobs=processes, worker_mem=worker_mem, timeout=timeout, clock=clock)
+    for res in sched.run(jobs):
+        progress.update(res)
+    progress.close()
+
+    if summary and jobs:
+        # with threads every solve shares one process, its peak is the whole run's
+        engine = dict(engine='threads', rss=solver.peak_rss()) if threads else dict(engine='processes')
+        with open(summary, 'w') as f:
+            json.dump(progress.summary(program=program, specs=list(specdirs), timeout=timeout, budget=walltime, **engine), f, indent=2)
+        trace(summary)
+
+    if tracefn and os.path.isfile(tracefn):
+        trace_summary(tracefn, since)
+
+
+def watched(fn):
+    name = os.path.basename(fn)
+    return name == 'task.desc' or fnmatch.fnmatch(name, 'prob-*.desc')
+
+
+def watch_target(root, fn, targetdir):
+    # blocks/<n>/task.desc all share a name, keep their directories
+    p = pathlib.Path(fn)
+    if p.name == 'task.desc':
+        return os.path.join(targetdir, p.parent.relative_to(root), 'task.sol')
+    return os.path.join(targetdir, p.with_suffix('.sol').name)
+
+
+class Backlog:
+    # newest first; a file is queued once per content, and one content is solved by one job at a time
+    def __init__(self):
+        self.heap = list()
+        self.queued = dict()
+        self.running = dict()
+        self.done = dict()
+        self.busy = set()
+        self.seq = 0
+
+    def __len__(self):
+        return len(self.queued)
+
+    def add(self, fn, tfn):
+        try:
+            st = os.stat(fn)
+            h = solcache.file_hash(fn)
+        except OSError:
+            return False
+        if h in (self.done.get(fn), self.running.get(fn), self.queued.get(fn, (None,))[0]):
+            return False
+        self.queued[fn] = (h, tfn)
+        heapq.heappush(self.heap, (-st.st_mtime, self.seq, fn, h))
+        self.seq += 1
+        return True
+
+    def pop(self):
+        held = list()
+        res = None
+        while self.heap:
+            x = heapq.heappop(self.heap)
+            _, _, fn, h = x
+            if self.queued.get(fn, (None,))[0] != h:
+                continue
+            if h in self.busy:
+                held.append(x)
+                continue
+            res = (fn, h, self.queued.pop(fn)[1])
+            self.running[fn] = h
+            self.busy.add(h)
+            break
+        for x in held:
+            heapq.heappush(self.heap, x)
+        return res
+
+    def finish(self, fn, h):
+        self.busy.discard(h)
+        if self.running.get(fn) == h:
+            del self.running[fn]
+        self.done[fn] = h
+
+    def put_back(self, fn, h, tfn):
+        # not solved after all, next in line unless a newer version was queued meanwhile
+        self.busy.discard(h)
+        if self.running.get(fn) == h:
+            del self.running[fn]
+        if fn not in self.queued:
+            self.queued[fn] = (h, tfn)
+            heapq.heappush(self.heap, (float('-inf'), self.seq, fn, h))
+            self.seq += 1
+
+
+def warm_up(program):
+    # load what every solve needs once per pool worker, not once per problem
+    for p in selector.PROGRAMS if program == 'auto' else [program]:
+        try:
+            solver.load_lib(p)
+        except OSError:
             pass
+    if program == 'auto':
+        selector.open_history(True).load()
+
+
+def watch(specdirs, program, targetdir, timeout=None, skip=False, skip_zero=False, verbose=False, tracefn=None, optimize=True,
+        processes=None, memory=None, worker_mem=None, warm=True, cache=True, history=None, portfolio=2, threads=False, poll=False):
+    roots = [os.path.abspath(x) for x in specdirs if os.path.isdir(x)]
+    if not roots:
+        trace('no directories to watch')
+        return
+    if tracefn:
+        tracefn = os.path.abspath(tracefn)
+    processes = processes or os.cpu_count()
+    if threads:
+        pool = multiprocessing.pool.ThreadPool(processes, initializer=warm_up, initargs=(program,))
+    else:
+        # a child per problem, forked warm, so one past its deadline can be killed like in batch runs;
+        # admitted and limited by their estimated memory the same way
+        pool = None
+        sched = Scheduler(dict(), budget=memory, jobs=processes, worker_mem=worker_mem)
+        warm_up(program)
+    children = dict()
+    results = queue.Queue()
+    backlog = Backlog()
+
+    def consider(fn, initial=False):
+        if not watched(fn): return
+        root = max((r for r in roots if fn.startswith(r + os.sep)), key=len)
+        tfn = watch_target(root, fn, targetdir)
+        if initial and os.path.isfile(tfn):
+            if skip and os.path.getsize(tfn) or skip_zero and not os.path.getsize(tfn):
+                return
+        if backlog.add(fn, tfn) and verbose:
+            trace(f'queued {fn}')
+
+    for root in roots:
+        for fn in watcher.walk_files(root):
+            consider(fn, initial=True)
+    w = watcher.open_watcher(roots, poll=poll)
+    # stop like on ^C when run as a service
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    trace(f'watching {" ".join(roots)}, {len(backlog)} queued')
+
+    running = 0
+    try:
+        while True:
+            while running < processes:
+                x = backlog.pop()
+                if not x: break
+                fn, h, tfn = x
+                os.makedirs(os.path.dirname(tfn) or '.', exist_ok=True)
+                job = (fn, tfn, program, timeout, verbose, tracefn, optimize, warm, cache, history, portfolio)
+                if pool:
+                    pool.apply_async(pworker, (job, lambda res, x=(fn, h): results.put((x, res, False))),
+                        callback=lambda res, x=(fn, h): results.put((x, res, True)),
+                        error_callback=lambda e, x=(fn, h): results.put((x, dict(name=fn, status='error', length=None, time=0), True)))
+                else:
+                    try:
+                        sched.sizes[fn] = problem_size(fn)
+                    except Exception:
+                        sched.sizes[fn] = 0
+                    est = sched.estimate(job)
+                    used = sum(c[5] for c in children.values())
+                    avail = available_memory()
+                    if children and (used + est > sched.budget or avail is not None and est > avail * 0.9):
+                        backlog.put_back(fn, h, tfn)
+                        break
+                    rx, tx = multiprocessing.Pipe(duplex=False)
+                    p = multiprocessing.Process(target=pchild, args=(job, sched.limit(job, est), tx))
+                    p.start()
+                    tx.close()
+                    start = time.monotonic()
+                    children[rx] = (p, (fn, h), job, start, start + timeout + 30 if timeout else None, est)
+                running += 1
+
+            for fn in w.changes(0.2):
+                consider(fn)
+
+            ready = multiprocessing.connection.wait(list(children), timeout=0) if children else []
+            now = time.monotonic()
+            for rx in list(children):
+                p, x, job, start, deadline, est = children[rx]
+                if rx in ready:
+                    try:
+                        res = rx.recv()
+                    except EOFError:
+                        res = dict(name=problem_name(job[0]), status='crashed', length=None, time=now - start)
+                elif deadline is not None and now >= deadline:
+                    p.kill()
+                    res = dict(name=problem_name(job[0]), status='timeout', length=None, time=now - start)
+                    if not os.path.isfile(job[1]):
+                        with open(job[1], 'w') as f: pass
+                else:
+                    continue
+                p.join()
+                rx.close()
+                del children[rx]
+                sched.model.observe(sched.sizes[x[0]], res.get('rss'))
+                if res['status'] in ('oom', 'crashed') and sched.limit(job, est) < sched.worker_mem:
+                    sched.retried.add(x[0])
+                    backlog.put_back(*x, job[1])
+                    running -= 1
+                    continue
+                sched.retried.discard(x[0])
+                results.put((x, res, True))
+
+            while True:
+                try:
+                    (fn, h), res, free = results.get_nowait()
+                except queue.Empty:
+                    break
+                running -= free
+                if not res: continue
+                backlog.finish(fn, h)
+                trace(f'{res["name"]}: {res["status"]} {res["length"]} in {res["time"]:.1f}s, {len(backlog)} queued')
+    except KeyboardInterrupt:
+        pass
+    finally:
+        w.close()
+        if pool:
+            pool.terminate()
+        for p, *_ in children.values():
+            p.kill()
+            p.join()
 
 
 if __name__ == '__main__':
     import argparse
     parser = argparse.ArgumentParser()
-    parser.add_argument('-n', '--program', nargs='?', default='greedy', help='Solver program')
+    parser.add_argument('-n', '--program', nargs='?', default='greedy', help='Solver program, auto to pick one per problem from past results')
+    parser.add_argument('-k', '--portfolio', type=int, default=2, help='Most programs to run per problem with auto')
+    parser.add_argument('--no-history', action='store_true', help='Do not record results for auto selection')
+    parser.add_argument('--record', action='store_true', help='Record results for auto selection from other programs too')
     parser.add_argument('-r', '--targetdir', metavar='DIR', default='.', help='Target directory for solutions')
-    parser.add_argument('-t', '--timeout', type=float, default=300, help='Solver timeout')
+    parser.add_argument('-t', '--timeout', type=float, help='Solver timeout, default 300, with --budget only a cap')
+    parser.add_argument('-b', '--budget', metavar='SEC', type=float, help='Wall-clock budget for the whole run, timeouts follow map size')
     parser.add_argument('-i', '--skip', action='store_true', help='Skip solved')
     parser.add_argument('-z', '--skip-zero', action='store_true', help='Skip timed out')
     parser.add_argument('-v', '--verbose', action='store_true')
-    parser.add_argument('specdir', metavar='SPEC', nargs='*', default='.', help='Directory with problems')
+    parser.add_argument('--raw', action='store_true', help='Skip the peephole post-optimizer')
+    parser.add_argument('--cold', action='store_true', help='Do not bound solvers by the score of existing solutions')
+    parser.add_argument('--no-cache', action='store_true', help='Always solve, ignore the solution cache')
+    parser.add_argument('--trace', metavar='FILE', default=os.environ.get(solver._trace_var), help='Append per-stage timings as JSON lines and print a summary')
+    parser.add_argument('-s', '--summary', metavar='FILE', help='Final summary as JSON, default DIR/batch-summary.json')
+    parser.add_argument('--report', metavar='SEC', type=float, default=30, help='Progress report interval when not on a terminal')
+    parser.add_argument('-j', '--jobs', type=int, help='Maximum number of solver processes or threads, default CPU count')
+    parser.add_argument('-T', '--threads', action='store_true', help='Solve on threads of one process instead of a process per problem')
+    parser.add_argument('-w', '--watch', action='store_true', help='Keep running, solve new and changed prob-*.desc and task.desc files in SPEC directories')
+    parser.add_argument('--poll', action='store_true', help='Watch by polling instead of inotify')
+    parser.add_argument('-m', '--memory', metavar='MB', type=int, help='Memory budget for all solvers, default 80%% of RAM')
+    parser.add_argument('--worker-mem', metavar='MB', type=int, help='Largest address space limit per solver process, default the budget plus 512 MB; '
+        'each one gets twice its estimated peak plus 512 MB, a job over that is retried once with the largest limit')
+    parser.add_argument('specdir', metavar='SPEC', nargs='*', default='.', help='Directory or zip archive with problems')
     args = parser.parse_args()
 
-    main(args.specdir, args.program, args.targetdir,
-        timeout=args.timeout,
-        skip=args.skip,
-        skip_zero=args.skip_zero,
-        verbose=args.verbose)
+    if args.watch:
+        watch(args.specdir, args.program, args.targetdir,
+            timeout=args.timeout or 300,
+            skip=args.skip,
+            skip_zero=args.skip_zero,
+            verbose=args.verbose,
+            tracefn=args.trace,
+            optimize=not args.raw,
+            processes=args.jobs,
+            memory=args.memory and args.memory * 2**20,
+            worker_mem=args.worker_mem and args.worker_mem * 2**20,
+            warm=not args.cold,
+            cache=not args.no_cache,
+            history=False if args.no_history else True if args.record else None,
+            portfolio=args.portfolio,
+            threads=args.threads,
+            poll=args.poll)
+    else:
+        main(args.specdir, args.program, args.targetdir,
+            timeout=args.timeout if args.timeout or args.budget else 300,
+            skip=args.skip,
+            skip_zero=args.skip_zero,
+            verbose=args.verbose,
+            tracefn=args.trace,
+            optimize=not args.raw,
+            summary=args.summary,
+            report=args.report,
+            processes=args.jobs,
+            memory=args.memory and args.memory * 2**20,
+            worker_mem=args.worker_mem and args.worker_mem * 2**20,
+            warm=not args.cold,
+            cache=not args.no_cache,
+            walltime=args.budget,
+            history=False if args.no_history else True if args.record else None,
+            portfolio=args.portfolio,
+            threads=args.threads)
@@ -0,0 +1,285 @@
+#!/usr/bin/env python
+import io
+import json
+import multiprocessing
+import os
+import pathlib
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+import zipfile
+from contextlib import contextmanager
+
+import digger
+import simulator
+import solver
+
+
+def trace(*args, **kwargs):
+    print(*args, file=sys.stderr, flush=True, **kwargs)
+
+
+_root_dir = os.path.join(os.path.dirname(__file__), '..')
+_spec_dir = os.path.join(_root_dir, 'spec')
+_block_dirs = [
+    os.path.join(os.path.dirname(__file__), 'lambda-client/blocks'),
+    os.path.join(_root_dir, 'data/blocks'),
+]
+
+SUBSETS = {
+    # small and mid-sized maps from part 1 and 2 that every engine finishes in seconds
+    'quick': [1, 11, 21, 51, 151],
+    'medium': range(1, 301, 10),
+    'full': range(1, 301),
+}
+
+# default timeout per case
+TIMEOUTS = {'quick': 60}
+
+STAGES = ['parse', 'gen_grid', 'marshal', 'solve', 'dig', 'e2e']
+
+
+class Probe:
+    def __init__(self):
+        self.stages = dict()
+
+    @contextmanager
+    def stage(self, name):
+        t = time.perf_counter()
+        yield
+        self.stages[name] = dict(time=time.perf_counter() - t, rss=solver.peak_rss())
+
+
+def read_source(src):
+    if isinstance(src, tuple):
+        fn, member = src
+        with zipfile.ZipFile(fn) as z:
+            return z.read(member).decode('utf8')
+    with open(src) as f:
+        return f.read()
+
+
+def collect(subset, blocks=3):
+    numbers = SUBSETS[subset]
+    cases = list()
+    for fn in sorted(pathlib.Path(_spec_dir).glob('part-*.zip')):
+        with zipfile.ZipFile(fn) as z:
+            for member in sorted(z.namelist()):
+                p = pathlib.PurePosixPath(member)
+                if not (p.name.startswith('prob-') and p.suffix == '.desc'): continue
+                if int(p.stem[5:]) not in numbers: continue
+                cases.append(('task', f'{fn.stem}/{p.stem}', (str(fn), member)))
+
+    conds = list()
+    for d in _block_dirs:
+        conds += sorted(pathlib.Path(d).glob('*/puzzle.cond'), key=lambda x: (len(x.parent.name), x.parent.name))
+    for fn in conds[:blocks]:
+        cases.append(('puzzle', f'blocks/{fn.parent.name}', str(fn)))
+    if not conds:
+        fn = os.path.join(_spec_dir, 'chain-puzzle-examples.zip')
+        cases.append(('puzzle', 'chain-puzzle-examples/puzzle', (fn, 'puzzle.cond')))
+    return cases
+
+
+def score(board, grid, ans):
+    if not ans:
+        return None
+    return simulator.score(simulator.grid_mask(grid, board.size), board.pos, board.boosters, ans)
+
+
+def run_stages(kind, src, program, seed, conn):
+    probe = Probe()
+    text = read_source(src)
+    res = dict()
+
+    if kind == 'task':
+        with probe.stage('parse'):
+            board = solver.Board.load(io.StringIO(text))
+        with probe.stage('gen_grid'):
+            grid = board.gen_grid()
+        state = solver.State(mine_size=board.size, pos=board.pos, rotation=0, grid=grid, boosters=board.boosters)
+        sol = solver.open_solver(program, stats=True)
+        with probe.stage('marshal'):
+            cx = sol.encode(state)
+        with probe.stage('solve'):
+            ans = sol.run(cx, board.size[0] * board.size[1] * 2)
+        res['score'] = score(board, grid, ans)
+        res['stats'] = sol.stats
+    else:
+        random.seed(seed)
+        with probe.stage('parse'):
+            puz = digger.Puzzle.loads(text)
+        with probe.stage('dig'):
+            board = digger.Generator().generate(puz)
+        res['score'] = len(board.outline)
+
+    res['stages'] = probe.stages
+    conn.send(res)
+
+
+def run_e2e(kind, src, program, seed, conn):
+    probe = Probe()
+    text = read_source(src)
+    with tempfile.TemporaryDirectory() as tmp:
+        with probe.stage('e2e'):
+            if kind == 'task':
+                solver.Worker(program, cache=False, history=False).solve(io.StringIO(text), os.path.join(tmp, 'task.sol'))
+            else:
+                random.seed(seed)
+                digger.Generator().generate(digger.Puzzle.loads(text)).save(os.path.join(tmp, 'task.desc'))
+    conn.send(dict(stages=probe.stages))
+
+
+def spawn(target, args, timeout):
+    ctx = multiprocessing.get_context('spawn')
+    rx, tx = ctx.Pipe(duplex=False)
+    p = ctx.Process(target=target, args=args + (tx,))
+    p.start()
+    tx.close()
+    res = rx.recv() if rx.poll(timeout) else None
+    p.join(1)
+    if p.is_alive():
+        p.terminate()
+        p.join()
+    return res
+
+
+def run_case(case, program, repeat=1, timeout=None, e2e=True, seed=0):
+    kind, name, src = case
+    runs = list()
+    for _ in range(repeat):
+        res = spawn(run_stages, (kind, src, program, seed), timeout)
+        if res is None:
+            return dict(kind=kind, error='timeout')
+        if e2e:
+            x = spawn(run_e2e, (kind, src, program, seed), timeout)
+            if x is None:
+                return dict(kind=kind, error='timeout')
+            res['stages'].update(x['stages'])
+        runs.append(res)
+
+    stages = dict()
+    for stage in runs[0]['stages']:
+        xs = [r['stages'][stage] for r in runs]
+        stages[stage] = dict(
+            time=statistics.median(x['time'] for x in xs),
+            rss=max(x['rss'] for x in xs))
+    res = dict(kind=kind, stages=stages, score=runs[0]['score'])
+    if runs[0].get('stats'):
+        res['stats'] = runs[0]['stats']
+    return res
+
+
+def compare(results, baseline, threshold, min_time):
+    regressions = list()
+
+    def check(name, what, new, old, slack=0):
+        if new > old * (1 + threshold) and new - old > slack:
+            regressions.append(f'{name} {what}: {old:.4g} -> {new:.4g} (+{(new / old - 1) * 100 if old else float("inf"):.0f}%)')
+
+    for name, res in results.items():
+        base = baseline['cases'].get(name)
+        if not base or 'error' in base: continue
+        if 'error' in res:
+            regressions.append(f'{name}: {res["error"]}')
+            continue
+        for stage, x in res['stages'].items():
+            y = base['stages'].get(stage)
+            if not y: continue
+            check(name, f'{stage} time', x['time'], y['time'], min_time)
+            check(name, f'{stage} rss', x['rss'], y['rss'])
+        if base.get('score') is not None:
+            if res.get('score') is None:
+                regressions.append(f'{name} score: {base["score"]} -> failed')
+            elif res['kind'] == 'task' and res['score'] > base['score']:
+                regressions.append(f'{name} score: {base["score"]} -> {res["score"]}')
+
+    totals = stage_totals(results)
+    for stage, t in stage_totals(baseline['cases']).items():
+        if stage in totals:
+            check('total', f'{stage} time', totals[stage], t, min_time)
+    return regressions
+
+
+def stage_totals(results):
+    totals = dict()
+    for res in results.values():
+        for stage, x in res.get('stages', dict()).items():
+            totals[stage] = totals.get(stage, 0) + x['time']
+    return totals
+
+
+def report(results):
+    def ms(x):
+        return f'{x["time"] * 1000:10.1f}' if x else ' ' * 10
+
+    trace(f'{"case":32}' + ''.join(f'{s:>10}' for s in STAGES) + f'{"rss MB":>10}{"score":>10}')
+    for name, res in results.items():
+        if 'error' in res:
+            trace(f'{name:32}  {res["error"]}')
+            continue
+        st = res['stages']
+        rss = max(x['rss'] for x in st.values()) / 2**20
+        trace(f'{name:32}' + ''.join(ms(st.get(s)) for s in STAGES) + f'{rss:10.1f}{str(res["score"]):>10}')
+    totals = stage_totals(results)
+    trace(f'{"total ms":32}' + ''.join(ms(dict(time=totals[s]) if s in totals else None) for s in STAGES))
+
+
+def main(program, subset='quick', repeat=1, timeout=None, e2e=True, save=None, baseline=None,
+        threshold=0.2, min_time=0.005, seed=0):
+    results = dict()
+    for case in collect(subset):
+        trace(case[1])
+        results[case[1]] = run_case(case, program, repeat=repeat, timeout=timeout, e2e=e2e, seed=seed)
+
+    report(results)
+
+    if save:
+        data = dict(
+            meta=dict(
+                program=program,
+                subset=subset,
+                repeat=repeat,
+                seed=seed,
+                python=platform.python_version(),
+                platform=platform.platform(),
+                date=time.strftime('%Y-%m-%dT%H:%M:%S'),
+            ),
+            cases=results,
+        )
+        with open(save, 'w') as f:
+            json.dump(data, f, indent=2)
+        trace(save)
+
+    if baseline:
+        with open(baseline) as f:
+            base = json.load(f)
+        regressions = compare(results, base, threshold, min_time)
+        for x in regressions:
+            trace('regression:', x)
+        if regressions:
+            exit(1)
+        trace('no regressions')
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--program', default='greedy', help='Solver program')
+    parser.add_argument('-s', '--subset', default='quick', choices=sorted(SUBSETS), help='Problem subset')
+    parser.add_argument('-k', '--repeat', type=int, default=1, help='Runs per case, median time is reported')
+    parser.add_argument('-t', '--timeout', type=float, help='Timeout per case, default 60 for quick, else 300')
+    parser.add_argument('--no-e2e', action='store_true', help='Skip end to end runs')
+    parser.add_argument('--seed', type=int, default=0, help='Digger random seed')
+    parser.add_argument('-o', '--save', metavar='FILE', help='Save results as JSON baseline')
+    parser.add_argument('-b', '--baseline', metavar='FILE', help='Compare against JSON baseline')
+    parser.add_argument('--threshold', type=float, default=0.2, help='Relative regression threshold')
+    parser.add_argument('--min-time', type=float, default=0.005, help='Ignore time regressions below this many seconds')
+    args = parser.parse_args()
+
+    main(args.program, subset=args.subset, repeat=args.repeat,
+        timeout=args.timeout or TIMEOUTS.get(args.subset, 300), e2e=not args.no_e2e,
+        save=args.save, baseline=args.baseline, threshold=args.threshold, min_time=args.min_time, seed=args.seed)
@@ -0,0 +1,463 @@
+#!/usr/bin/env python
+import email.parser
+import email.policy
+import io
+import json
+import math
+import os
+import pathlib
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import digger
+import simulator
+import solver
+
+
+def trace(*args, **kwargs):
+    print(*args, file=sys.stderr, flush=True, **kwargs)
+
+
+_here = os.path.dirname(__file__)
+_blocks_dir = os.path.join(_here, 'lambda-client/blocks')
+_lambdad = os.path.join(_here, 'lambda-client/lambdad.py')
+_miner = os.path.join(_here, 'miner.py')
+# where miner.py keeps its work, it cannot be moved without changing the miner
+_miner_dir = os.path.join(_here, '../data/blocks')
+
+STAGES = ['notice', 'dig', 'solve', 'validate', 'submit', 'total']
+
+
+class ReplayError(Exception): pass
+
+
+def read_file(fn, default=None):
+    try:
+        with open(fn) as f:
+            return f.read()
+    except OSError:
+        return default
+
+
+def stored_blocks(path):
+    res = dict()
+    for d in pathlib.Path(path).iterdir():
+        if d.name.isdecimal() and (d / 'task.desc').is_file() and (d / 'puzzle.cond').is_file():
+            res[int(d.name)] = d
+    return dict(sorted(res.items()))
+
+
+def check_puzzle(cond, desc):
+    # the chain's acceptance rules for a puzzle solution
+    puz = digger.Puzzle.loads(cond)
+    board = solver.Board.load(io.StringIO(desc))
+    grid = board.gen_grid()
+    errors = list()
+    if min(min(p) for p in board.mine) < 0 or max(board.size) > puz.tsize:
+        errors.append(f'mine does not fit in {puz.tsize}x{puz.tsize}')
+    if max(board.size) < puz.tsize - puz.tsize // 10:
+        errors.append(f'mine is too small, {board.size}')
+    if len(grid) < math.ceil(0.2 * puz.tsize ** 2):
+        errors.append(f'area {len(grid)} is too small')
+    if not (puz.vmin <= len(board.mine) <= puz.vmax):
+        errors.append(f'{len(board.mine)} vertices, expected {puz.vmin}..{puz.vmax}')
+    counts = zip('BFLRCX', [puz.manipulators, puz.wheels, puz.drills, puz.teleports, puz.clonings, puz.spawns])
+    for t, n in counts:
+        k = sum(1 for x, _ in board.boosters if x == t)
+        if k != n:
+            errors.append(f'{k} boosters {t}, expected {n}')
+    if board.pos not in grid or any(p not in grid for _, p in board.boosters):
+        errors.append('start or booster outside the mine')
+    if any(p not in grid for p in puz.include_pos):
+        errors.append('included point outside the mine')
+    if any(p in grid for p in puz.exclude_pos):
+        errors.append('excluded point inside the mine')
+    return errors
+
+
+def validate(task, puzzle, sol, desc):
+    res = dict(task=None, puzzle=None, errors=list())
+    try:
+        board = solver.Board.load(io.StringIO(task))
+        free = simulator.grid_mask(board.gen_grid(), board.size)
+        res['task'] = simulator.score(free, board.pos, board.boosters, sol.strip()) if sol.strip() else None
+    except Exception as e:
+        res['errors'].append(f'task: {e}')
+    if res['task'] is None:
+        res['errors'].append('task: invalid solution')
+    try:
+        errors = check_puzzle(puzzle, desc)
+    except Exception as e:
+        errors = [str(e)]
+    res['puzzle'] = not errors
+    res['errors'] += [f'puzzle: {x}' for x in errors]
+    return res
+
+
+class Chain:
+    # replays stored blocks, block k of the replay becomes current at start + offset k
+    def __init__(self, path=None, first=None, count=None, interval=60, speed=None):
+        self.stored = stored_blocks(path or _blocks_dir)
+        if not self.stored:
+            raise ReplayError(f'no blocks in {path or _blocks_dir}')
+        numbers = [n for n in self.stored if first is None or n >= first]
+        self.numbers = numbers[:count] if count else numbers
+        if not self.numbers:
+            raise ReplayError(f'no blocks from {first}')
+        if speed:
+            ts = [float(read_file(self.stored[n] / 'timestamp.txt', 0)) for n in self.numbers]
+            self.offsets = [(x - ts[0]) / speed for x in ts]
+        else:
+            self.offsets = [k * interval for k in range(len(self.numbers))]
+        self.start_time = None
+        self.lock = threading.Lock()
+        self.published = dict()
+        self.noticed = dict()
+        self.submitted = dict()
+
+    def start(self):
+        self.start_time = time.time()
+
+    def current(self):
+        now = time.time() - (self.start_time or time.time())
+        k = max(i for i, x in enumerate(self.offsets) if x <= now)
+        with self.lock:
+            for i in range(k + 1):
+                self.published.setdefault(self.numbers[i], self.start_time + self.offsets[i])
+        return self.numbers[k]
+
+    def finished(self):
+        return len(self.published) == len(self.numbers)
+
+    def block_ts(self, n):
+        if n in self.published:
+            return self.published[n]
+        return float(read_file(self.stored[n] / 'timestamp.txt', 0))
+
+    def blockinfo(self, n=None):
+        cur = self.current()
+        if n == cur:
+            # the miner asks for the block by number, lambdad polls without one
+            with self.lock:
+                self.noticed.setdefault(n, time.time())
+        if n is None:
+            n = cur
+        if n not in self.stored or n > cur:
+            return None
+        d = self.stored[n]
+        return dict(
+            block=n,
+            block_ts=self.block_ts(n),
+            balances=json.loads(read_file(d / 'balances.json', '{}')),
+            task=read_file(d / 'task.desc'),
+            puzzle=read_file(d / 'puzzle.cond'),
+            excluded=[],
+        )
+
+    def chaininfo(self):
+        n = self.current()
+        with self.lock:
+            subs = sum(len(x) for x in self.submitted.values())
+            return dict(block=n, block_ts=self.block_ts(n), block_subs=len(self.submitted.get(n, [])), total_subs=subs)
+
+    def mininginfo(self):
+        x = self.blockinfo()
+        return dict(block=x['block'], excluded=x['excluded'], puzzle=x['puzzle'], task=x['task'])
+
+    def submit(self, private_id, n, sol, desc):
+        t = time.time()
+        cur = self.current()
+        if n not in self.stored or n != cur:
+            return dict(ok=False, block=n, errors=[f'block {n} is not current, {cur} is'])
+        d = self.stored[n]
+        res = validate(read_file(d / 'task.desc'), read_file(d / 'puzzle.cond'), sol, desc)
+        res.update(ok=not res['errors'], block=n)
+        with self.lock:
+            self.submitted.setdefault(n, list()).append(dict(id=private_id, ts=t, validate=time.time() - t, **res))
+        trace(f'block {n}: submission from {private_id}, task {res["task"]}, puzzle {res["puzzle"]}')
+        return res
+
+
+def parse_form(headers, body):
+    ctype = headers.get('Content-Type', '')
+    if ctype.startswith('application/x-www-form-urlencoded'):
+        return {k: v[0] for k, v in urllib.parse.parse_qs(body.decode()).items()}
+    msg = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(
+        f'Content-Type: {ctype}\r\n\r\n'.encode() + body)
+    res = dict()
+    for part in msg.iter_parts():
+        name = part.get_param('name', header='content-disposition')
+        if name:
+            res[name] = part.get_payload(decode=True).decode()
+    return res
+
+
+class Handler(BaseHTTPRequestHandler):
+    chain = None
+
+    def log_message(self, *args):
+        pass
+
+    def reply(self, data, code=200):
+        body = json.dumps(data).encode()
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def route(self):
+        parts = [x for x in urllib.parse.urlparse(self.path).path.split('/') if x]
+        if parts[:1] == ['lambda']:
+            parts = parts[1:]
+        return parts[0] if parts else None, parts[1] if len(parts) > 1 else None
+
+    def do_GET(self):
+        method, arg = self.route()
+        chain = self.chain
+        if method == 'getblockchaininfo':
+            res = chain.chaininfo()
+        elif method == 'getmininginfo':
+            res = chain.mininginfo()
+        elif method == 'getbalances':
+            res = chain.blockinfo()['balances']
+        elif method == 'getbalance':
+            res = chain.blockinfo()['balances'].get(arg, 0)
+        elif method == 'getblockinfo' and (arg is None or arg.isdecimal()):
+            res = chain.blockinfo(None if arg is None else int(arg))
+        else:
+            res = None
+        if res is None:
+            return self.reply(dict(error='not found'), 404)
+        self.reply(res)
+
+    def do_POST(self):
+        method, _ = self.route()
+        if method != 'submit':
+            return self.reply(dict(error='not found'), 404)
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        form = parse_form(self.headers, body)
+        try:
+            n = int(form.get('block_num'))
+        except (TypeError, ValueError):
+            return self.reply(dict(ok=False, errors=['bad block_num']), 400)
+        self.reply(self.chain.submit(form.get('private_id'), n, form.get('solution', ''), form.get('puzzle', '')))
+
+
+def open_server(chain, host='127.0.0.1', port=5000):
+    handler = type('ChainHandler', (Handler,), dict(chain=chain))
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def wait_port(port, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return True
+        except OSError:
+            time.sleep(0.2)
+    return False
+
+
+def stop(p):
+    if p.poll() is None:
+        try:
+            os.killpg(p.pid, 15)
+            p.wait(5)
+        except (OSError, subprocess.TimeoutExpired):
+            os.killpg(p.pid, 9)
+            p.wait()
+
+
+def solver_times(fn):
+    # miner solves through solver.Worker, which traces the task it was given
+    res = dict()
+    for line in (read_file(fn) or '').splitlines():
+        x = json.loads(line)
+        block = pathlib.Path(x.get('problem') or '').parent.name
+        if block.isdecimal():
+            res[int(block)] = (x['ts'], x['ts'] + sum(s['time'] for s in x['stages'].values()))
+    return res
+
+
+def digger_times(block, since):
+    d = pathlib.Path(_miner_dir) / str(block)
+    try:
+        a = (d / 'puzzle.cond').stat().st_mtime
+        b = (d / 'puzzle-sol.desc').stat().st_mtime
+    except OSError:
+        return None
+    return (a, b) if a >= since and b >= a else None
+
+
+def measure(chain, solved):
+    rows = dict()
+    for n in chain.numbers:
+        pub = chain.published.get(n)
+        if pub is None: continue
+        row = dict()
+        seen = chain.noticed.get(n)
+        sub = (chain.submitted.get(n) or [None])[0]
+        dig = digger_times(n, pub)
+        sol = solved.get(n) if n in solved and solved[n][0] >= pub else None
+        if seen:
+            row['notice'] = seen - pub
+        if dig:
+            row['dig'] = dig[1] - dig[0]
+        if sol:
+            row['solve'] = sol[1] - sol[0]
+        if sub:
+            row['validate'] = sub['validate']
+            done = max([x[1] for x in (dig, sol) if x] or [seen or pub])
+            row['submit'] = max(0, sub['ts'] - done)
+            row['total'] = sub['ts'] + sub['validate'] - pub
+            row['score'] = sub['task']
+            row['ok'] = sub['ok']
+        else:
+            row['missed'] = True
+        rows[n] = row
+    return rows
+
+
+def report(rows):
+    def s(x):
+        return f'{x:10.2f}' if x is not None else f'{"-":>10}'
+
+    trace(f'{"block":8}' + ''.join(f'{x:>10}' for x in STAGES) + f'{"score":>10}')
+    for n, row in rows.items():
+        extra = '  missed' if row.get('missed') else '' if row.get('ok') else '  invalid'
+        trace(f'{n:<8}' + ''.join(s(row.get(x)) for x in STAGES) + f'{str(row.get("score")):>10}{extra}')
+    for name, fn in [('median', statistics.median), ('max', max)]:
+        xs = [[r[x] for r in rows.values() if x in r] for x in STAGES]
+        trace(f'{name:8}' + ''.join(s(fn(x) if x else None) for x in xs))
+
+
+def replay(path=None, first=None, count=3, interval=60, speed=None, port=5000, rpc_port=8332,
+        timeout=1800, cache=False, clean=False, verbose=False, save=None):
+    chain = Chain(path, first=first, count=count, interval=interval, speed=speed)
+    stale = [n for n in chain.numbers if (pathlib.Path(_miner_dir) / str(n)).exists()]
+    if stale and not clean:
+        raise ReplayError(f'miner data for blocks {stale} exists in {os.path.abspath(_miner_dir)}, use --clean to remove it')
+    for n in stale:
+        shutil.rmtree(pathlib.Path(_miner_dir) / str(n))
+
+    server = open_server(chain, port=port)
+    procs = list()
+    with tempfile.TemporaryDirectory() as tmp:
+        with open(os.path.join(tmp, 'lambda.conf'), 'w') as f:
+            f.write(f'[DEFAULT]\nDataDir = {tmp}/blocks/\n'
+                f'DecentralisationProvider = http://127.0.0.1:{server.server_address[1]}/lambda/\n'
+                f'DefaultBindAddress = 127.0.0.1\nDefaultPort = {rpc_port}\n'
+                f'\n[SECRET]\nPrivateKey = replay\nPublicKey = replay\n')
+        tracefn = os.path.join(tmp, 'trace.jsonl')
+        env = dict(os.environ, ICFPC_TRACE=tracefn)
+        out = None if verbose else subprocess.DEVNULL
+
+        try:
+            procs.append(subprocess.Popen([sys.executable, os.path.abspath(_lambdad)], cwd=tmp,
+                stdout=out, stderr=out, start_new_session=True))
+            if not wait_port(rpc_port):
+                raise ReplayError(f'lambdad did not start on port {rpc_port}, -v shows its output')
+
+            chain.start()
+            args = [sys.executable, os.path.abspath(_miner), '-f', '-p', str(rpc_port)] + ([] if cache else ['--no-cache'])
+            procs.append(subprocess.Popen(args, env=env, stdout=out, stderr=out, start_new_session=True))
+            trace(f'replaying blocks {chain.numbers[0]}..{chain.numbers[-1]}')
+
+            last = None
+            while True:
+                time.sleep(1)
+                n = chain.current()
+                if n != last:
+                    trace(f'block {n} published')
+                    last = n
+                for p in procs:
+                    if p.poll() is not None:
+                        raise ReplayError(f'{p.args[1]} exited with {p.returncode}')
+                if chain.finished() and (n in chain.submitted or time.time() > chain.published[n] + timeout):
+                    break
+        finally:
+            for p in procs:
+                stop(p)
+            server.shutdown()
+
+        rows = measure(chain, solver_times(tracefn))
+
+    report(rows)
+    if save:
+        with open(save, 'w') as f:
+            json.dump(dict(blocks=rows, interval=interval, speed=speed), f, indent=2)
+        trace(save)
+    return rows
+
+
+def serve(path=None, first=None, count=None, interval=60, speed=None, host='127.0.0.1', port=5000):
+    chain = Chain(path, first=first, count=count, interval=interval, speed=speed)
+    server = open_server(chain, host=host, port=port)
+    chain.start()
+    trace(f'serving blocks {chain.numbers[0]}..{chain.numbers[-1]} on http://{host}:{server.server_address[1]}/lambda/')
+    last = None
+    try:
+        while True:
+            n = chain.current()
+            if n != last:
+                trace(f'block {n} published')
+                last = n
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser()
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    def clock_args(p):
+        p.add_argument('-d', '--blocks', metavar='DIR', help='Stored blocks directory')
+        p.add_argument('-f', '--first', type=int, help='First block to replay')
+        p.add_argument('-i', '--interval', type=float, default=60, help='Seconds between blocks')
+        p.add_argument('--speed', type=float, help='Use the recorded block times, sped up this many times')
+        p.add_argument('-p', '--port', type=int, default=5000, help='Chain port')
+
+    p = sub.add_parser('serve', help='Serve stored blocks as the chain endpoint for lambdad')
+    clock_args(p)
+    p.add_argument('-N', '--count', type=int, help='Number of blocks')
+    p.add_argument('-b', '--bind', default='127.0.0.1', help='Address to listen on')
+
+    p = sub.add_parser('replay', help='Replay blocks through lambdad and miner, report stage latencies')
+    clock_args(p)
+    p.add_argument('-N', '--count', type=int, default=3, help='Number of blocks')
+    p.add_argument('--rpc-port', type=int, default=8332, help='Port for lambdad')
+    p.add_argument('-t', '--timeout', type=float, default=1800, help='Wait this long for the last submission')
+    p.add_argument('--cache', action='store_true', help='Let the miner use the solution cache')
+    p.add_argument('--clean', action='store_true', help='Remove miner data of the replayed blocks first')
+    p.add_argument('-v', '--verbose', action='store_true', help='Show lambdad and miner output')
+    p.add_argument('-o', '--save', metavar='FILE', help='Save latencies as JSON')
+
+    args = parser.parse_args()
+
+    try:
+        if args.command == 'serve':
+            serve(args.blocks, first=args.first, count=args.count, interval=args.interval, speed=args.speed,
+                host=args.bind, port=args.port)
+        else:
+            replay(args.blocks, first=args.first, count=args.count, interval=args.interval, speed=args.speed,
+                port=args.port, rpc_port=args.rpc_port, timeout=args.timeout, cache=args.cache, clean=args.clean,
+                verbose=args.verbose, save=args.save)
+    except ReplayError as e:
+        trace(e)
+        exit(1)
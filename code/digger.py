@@ -38,6 +38,11 @@ class Puzzle:
         self.include_pos = include_pos
         self.exclude_pos = exclude_pos
 
+    def dumps(self):
+        head = ','.join(map(str, [self.block, self.epoch, self.tsize, self.vmin, self.vmax, self.manipulators,
+            self.wheels, self.drills, self.teleports, self.clonings, self.spawns]))
+        return '#'.join([head, dump_points(self.include_pos), dump_points(self.exclude_pos)])
+
 
 points_rx = re.compile(r',?\((\d+),(\d+)\)')
 
@@ -161,7 +166,7 @@ class Generator:
                     if p in xpos:
                         pending.add(p)
 
-            for p in random.sample(pending, len(pending)):
+            for p in random.sample(list(pending), len(pending)):
                 connect1(p)
 
         return xgrid
@@ -189,14 +194,14 @@ class Generator:
             return cc
 
         def cccn(mine):
-            bs = walkcc(random.sample(mine, 1)[0], mine)
-            ws = walkcc(random.sample(ipos, 1)[0], mine)
+            bs = walkcc(random.sample(list(mine), 1)[0], mine)
+            ws = walkcc(random.sample(list(ipos), 1)[0], mine)
             return len(bs) + len(ws)
 
         xcc = cccn(mine)
 
         def dig1(mine):
-            p, = random.sample(mine, 1)
+            p, = random.sample(list(mine), 1)
             for i in mvs:
                 q = p + i
                 if q in mine:
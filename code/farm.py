@@ -0,0 +1,274 @@
+#!/usr/bin/env python
+import io
+import multiprocessing
+import os
+import socket
+import socketserver
+import sys
+import threading
+import time
+import xmlrpc.client
+from collections import deque
+from xmlrpc.server import SimpleXMLRPCServer
+
+import batch
+import peephole
+import simulator
+import solver
+
+
+def trace(*args, **kwargs):
+    print(*args, file=sys.stderr, flush=True, **kwargs)
+
+
+def evaluate(desc, ans):
+    if not ans:
+        return None
+    board = solver.Board.load(io.StringIO(desc))
+    free = simulator.grid_mask(board.gen_grid(), board.size)
+    return simulator.score(free, board.pos, board.boosters, ans)
+
+
+class Coordinator:
+    def __init__(self, jobs, lease=60, verify=True):
+        self.jobs = dict()
+        self.pending = deque()
+        for name, infile, tfn in jobs:
+            self.jobs[name] = (infile, tfn)
+            self.pending.append(name)
+        self.lease_time = lease
+        self.verify = verify
+        self.leases = dict()
+        self.best = dict()
+        self.solved = 0
+        self.lock = threading.Lock()
+        self.finished = threading.Event()
+        if not self.pending:
+            self.finished.set()
+
+    def expire(self):
+        now = time.monotonic()
+        for name, (worker, deadline) in list(self.leases.items()):
+            if deadline < now:
+                trace(f'{name}: lease of {worker} expired')
+                del self.leases[name]
+                self.pending.appendleft(name)
+
+    def lease(self, worker):
+        with self.lock:
+            self.expire()
+            if not self.pending:
+                if not self.leases:
+                    self.finished.set()
+                    return dict(done=True)
+                return dict(wait=min(5, self.lease_time / 4))
+            name = self.pending.popleft()
+            self.leases[name] = (worker, time.monotonic() + self.lease_time)
+
+        infile, tfn = self.jobs[name]
+        with batch.open_problem(infile) as f:
+            desc = f.read()
+        return dict(name=name, desc=desc, lease=self.lease_time)
+
+    def renew(self, worker, name):
+        with self.lock:
+            x = self.leases.get(name)
+            if not x or x[0] != worker:
+                return False
+            self.leases[name] = (worker, time.monotonic() + self.lease_time)
+            return True
+
+    def current(self, name):
+        if name not in self.best:
+            infile, tfn = self.jobs[name]
+            score = None
+            if os.path.isfile(tfn) and os.path.getsize(tfn):
+                with batch.open_problem(infile) as f:
+                    desc = f.read()
+                with open(tfn) as f:
+                    score = evaluate(desc, f.read().strip())
+            self.best[name] = score
+        return self.best[name]
+
+    def submit(self, worker, name, ans, score):
+        if name not in self.jobs:
+            return False
+        if ans and self.verify:
+            with batch.open_problem(self.jobs[name][0]) as f:
+                desc = f.read()
+            x = evaluate(desc, ans)
+            if x != score:
+                trace(f'{name}: {worker} reported {score}, verified {x}')
+            score = x
+
+        self.current(name)
+        with self.lock:
+            x = self.leases.get(name)
+            if x and x[0] == worker:
+                del self.leases[name]
+            old = self.best[name]
+            better = score is not None and (old is None or score < old)
+            if better:
+                tfn = self.jobs[name][1]
+                with open(tfn + '.tmp', 'w') as f:
+                    f.write(ans)
+                os.replace(tfn + '.tmp', tfn)
+                self.best[name] = score
+            self.solved += 1
+            trace(f'[{self.solved}/{len(self.jobs)}] {name}: {score} (best {self.best[name]}) from {worker}')
+            if not self.pending and not self.leases:
+                self.finished.set()
+            return better
+
+
+class Server(socketserver.ThreadingMixIn, SimpleXMLRPCServer):
+    daemon_threads = True
+
+
+def serve(jobs, host='0.0.0.0', port=8400, lease=60, verify=True, workers=0, program='greedy', timeout=None):
+    coord = Coordinator(jobs, lease=lease, verify=verify)
+    server = Server((host, port), allow_none=True, logRequests=False)
+    server.register_instance(coord)
+    t = threading.Thread(target=server.serve_forever, daemon=True)
+    t.start()
+    trace(f'serving {len(coord.jobs)} problems on {host}:{server.server_address[1]}')
+
+    local = list()
+    for _ in range(workers):
+        p = multiprocessing.Process(target=work, args=(f'http://127.0.0.1:{server.server_address[1]}', program, timeout))
+        p.start()
+        local.append(p)
+
+    coord.finished.wait()
+    for p in local:
+        p.join()
+    # let idle remote workers poll once more and see there is nothing left
+    time.sleep(min(5, lease / 4) * 2)
+    server.shutdown()
+
+
+def solve_job(desc, program, conn):
+    board = solver.Board.load(io.StringIO(desc))
+    grid = board.gen_grid()
+    state = solver.State(mine_size=board.size, pos=board.pos, rotation=0, grid=grid, boosters=board.boosters)
+    ans = solver.open_solver(program).solve(state)
+    score = None
+    if ans:
+        free = simulator.grid_mask(grid, board.size)
+        ans = peephole.optimize(free, board.pos, board.boosters, ans)
+        score = simulator.score(free, board.pos, board.boosters, ans)
+    conn.send((ans, score))
+
+
+def spawn_job(desc, program, timeout, heartbeat):
+    rx, tx = multiprocessing.Pipe(duplex=False)
+    p = multiprocessing.Process(target=solve_job, args=(desc, program, tx))
+    p.start()
+    tx.close()
+    deadline = time.monotonic() + timeout if timeout else None
+    res = None
+    while True:
+        wait = heartbeat if deadline is None else min(heartbeat, deadline - time.monotonic())
+        if wait > 0 and rx.poll(wait):
+            try:
+                res = rx.recv()
+            except EOFError:
+                pass
+            break
+        if not p.is_alive() or (deadline is not None and time.monotonic() >= deadline):
+            break
+        yield None
+    if p.is_alive():
+        p.terminate()
+    p.join()
+    yield res or (None, None)
+
+
+def work(url, program='greedy', timeout=None, retries=12):
+    server = xmlrpc.client.ServerProxy(url, allow_none=True)
+    worker = f'{socket.gethostname()}:{os.getpid()}'
+
+    failures = 0
+    while True:
+        try:
+            job = server.lease(worker)
+            failures = 0
+        except (OSError, xmlrpc.client.Error) as e:
+            trace(worker, e)
+            failures += 1
+            if failures >= retries:
+                break
+            time.sleep(5)
+            continue
+
+        if job.get('done'):
+            break
+        if 'wait' in job:
+            time.sleep(job['wait'])
+            continue
+
+        name = job['name']
+        trace(worker, name)
+        for res in spawn_job(job['desc'], program, timeout, job['lease'] / 3):
+            if res is None:
+                try:
+                    server.renew(worker, name)
+                except (OSError, xmlrpc.client.Error) as e:
+                    trace(worker, e)
+        ans, score = res
+        if ans is None:
+            trace(worker, name, 'failed')
+
+        for _ in range(retries):
+            try:
+                server.submit(worker, name, ans, score)
+                break
+            except (OSError, xmlrpc.client.Error) as e:
+                trace(worker, e)
+                time.sleep(5)
+
+
+def collect(specdirs, targetdir, skip=False):
+    for spec in specdirs:
+        for fn, infile in batch.problems(spec):
+            tfn = os.path.join(targetdir, fn.with_suffix('.sol').name)
+            if skip and os.path.isfile(tfn) and os.path.getsize(tfn):
+                continue
+            yield batch.problem_name(infile), infile, tfn
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser()
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p = sub.add_parser('serve', help='Hand out problems and keep the best solutions')
+    p.add_argument('-r', '--targetdir', metavar='DIR', default='.', help='Target directory for solutions')
+    p.add_argument('-b', '--bind', default='0.0.0.0', help='Address to listen on')
+    p.add_argument('-p', '--port', type=int, default=8400, help='Port to listen on')
+    p.add_argument('-l', '--lease', type=float, default=60, help='Lease time before a silent worker is considered lost')
+    p.add_argument('-i', '--skip', action='store_true', help='Skip solved')
+    p.add_argument('--no-verify', action='store_true', help='Trust the scores reported by workers')
+    p.add_argument('-j', '--workers', type=int, default=0, help='Also start this many local workers')
+    p.add_argument('-n', '--program', default='greedy', help='Solver program for local workers')
+    p.add_argument('-t', '--timeout', type=float, default=300, help='Solver timeout for local workers')
+    p.add_argument('specdir', metavar='SPEC', nargs='*', default='.', help='Directory or zip archive with problems')
+
+    p = sub.add_parser('work', help='Pull problems from a coordinator and solve them')
+    p.add_argument('-n', '--program', default='greedy', help='Solver program')
+    p.add_argument('-t', '--timeout', type=float, default=300, help='Solver timeout')
+    p.add_argument('-j', '--jobs', type=int, default=1, help='Number of worker processes')
+    p.add_argument('url', help='Coordinator address, http://host:port')
+
+    args = parser.parse_args()
+
+    if args.command == 'serve':
+        jobs = list(collect(args.specdir, args.targetdir, skip=args.skip))
+        serve(jobs, host=args.bind, port=args.port, lease=args.lease, verify=not args.no_verify,
+            workers=args.workers, program=args.program, timeout=args.timeout)
+    else:
+        ps = [multiprocessing.Process(target=work, args=(args.url, args.program, args.timeout)) for _ in range(args.jobs)]
+        for p in ps:
+            p.start()
+        for p in ps:
+            p.join()
@@ -1,3 +1,4 @@
+#include <chrono>
 #include <csignal>
 #include <cstdint>
 #include <cstdio>
@@ -14,15 +15,37 @@ typedef int32_t i32;
 typedef uint8_t u8;
 typedef uint16_t u16;
 typedef uint32_t u32;
+typedef uint64_t u64;
 
 
 extern "C" {
+    typedef enum : u32 {
+        PhaseSetup,
+        PhaseClosest,
+        PhasePath,
+        PhaseApply,
+        PhaseCount,
+    } Phase;
+
+    typedef struct {
+        u64 nodes; // cells expanded by every search
+        u64 bfs_calls;
+        u64 path_calls;
+        u64 peak_alloc; // bytes held by search containers, estimated from their sizes
+        double phase_time[PhaseCount]; // seconds, closest includes path
+        u32 boosters_used[6]; // B F L R C X
+    } Stats;
+
     typedef struct {
         u16 posx;
         u16 posy;
         u8 rotation; // r * 90
         u32 grid_size; // len(tuples)
         u16* grid;
+        u32 booster_size;
+        void* boosters;
+        u32 bound; // score to beat, 0 if none
+        Stats* stats; // filled in if not null
     } Problem;
 
     u32 solve(Problem* problem, u32 ans_size, char* ans);
@@ -34,6 +57,53 @@ extern "C" {
 #define POSY(p) (((p) >> 16) & 0xffff)
 
 
+typedef chrono::steady_clock Clock;
+
+// std::set node: three links, a color and the key
+static const u64 set_node_size = 4 * sizeof(void*) + sizeof(u32);
+
+static double
+seconds_since(Clock::time_point t) {
+    return chrono::duration<double>(Clock::now() - t).count();
+}
+
+static void
+note_alloc(Stats* stats, u64 bytes) {
+    if (stats && bytes > stats->peak_alloc) {
+        stats->peak_alloc = bytes;
+    }
+}
+
+struct PhaseTimer {
+    Stats* stats;
+    Phase phase;
+    Clock::time_point start;
+
+    PhaseTimer(Stats* stats, Phase phase) : stats(stats), phase(phase), start(Clock::now()) {}
+
+    ~PhaseTimer() {
+        if (stats) {
+            stats->phase_time[phase] += seconds_since(start);
+        }
+    }
+};
+
+// whatever the search phases did not take
+struct SolveTimer {
+    Stats* stats;
+    Clock::time_point start;
+
+    SolveTimer(Stats* stats) : stats(stats), start(Clock::now()) {}
+
+    ~SolveTimer() {
+        if (stats) {
+            double* t = stats->phase_time;
+            t[PhaseApply] = seconds_since(start) - t[PhaseSetup] - t[PhaseClosest];
+        }
+    }
+};
+
+
 static vector<u32>
 move_bot(const vector<u32>& bot, i32 tx, i32 ty) {
     vector<u32> res;
@@ -140,7 +210,12 @@ static Movement valid_moves[] = {
 
 
 static vector<ActionType>
-find_path(u32 origin, u32 goal, const set<u32>& grid) {
+find_path(u32 origin, u32 goal, const set<u32>& grid, Stats* stats, u64 held) {
+    PhaseTimer timer(stats, PhasePath);
+    if (stats) {
+        stats->path_calls++;
+    }
+
     auto comp = [goal](const find_path_state& a, const find_path_state& b) {
         u32 va = a.path.size() + mdist(a.pos, goal);
         u32 vb = b.path.size() + mdist(b.pos, goal);
@@ -166,6 +241,11 @@ find_path(u32 origin, u32 goal, const set<u32>& grid) {
         }
         visited.emplace(state.pos);
 
+        if (stats) {
+            stats->nodes++;
+            note_alloc(stats, held + visited.size() * set_node_size + fringe.size() * (sizeof(state) + state.path.size()));
+        }
+
         for (auto mv : valid_moves) {
             u32 x = POSX(state.pos) + mv.x;
             u32 y = POSY(state.pos) + mv.y;
@@ -183,7 +263,12 @@ find_path(u32 origin, u32 goal, const set<u32>& grid) {
 
 
 static vector<ActionType>
-find_closest(u32 origin, set<u32> pending, const set<u32>& grid) {
+find_closest(u32 origin, set<u32> pending, const set<u32>& grid, Stats* stats) {
+    PhaseTimer timer(stats, PhaseClosest);
+    if (stats) {
+        stats->bfs_calls++;
+    }
+
     deque<u32> fringe;
     fringe.emplace_back(origin);
     set<u32> visited;
@@ -201,11 +286,18 @@ find_closest(u32 origin, set<u32> pending, const set<u32>& grid) {
         }
         visited.emplace(pos);
 
+        u64 held = 0;
+        if (stats) {
+            stats->nodes++;
+            held = (pending.size() + visited.size()) * set_node_size + fringe.size() * sizeof(u32);
+            note_alloc(stats, held);
+        }
+
         auto it = pending.find(pos);
         if (it != pending.end()) {
             pending.erase(it);
 
-            auto path = find_path(origin, pos, grid);
+            auto path = find_path(origin, pos, grid, stats, held);
             if (best_path.empty() || path.size() < best_path.size()) {
                 best_path = path;
                 best_target = pos;
@@ -251,6 +343,12 @@ solve(Problem* problem, u32 ans_size, char* ans) {
 
     ans[0] = 0;
 
+    Stats* stats = problem->stats;
+    if (stats) {
+        memset(stats, 0, sizeof(*stats));
+    }
+    SolveTimer timer(stats);
+
     set<u32> grid;
 
     u16* pgrid = problem->grid;
@@ -279,11 +377,21 @@ solve(Problem* problem, u32 ans_size, char* ans) {
         // }
     }
 
+    if (stats) {
+        stats->phase_time[PhaseSetup] = seconds_since(timer.start);
+    }
+
     string ans_path;
+    u32 ticks = 0;
 
     while (!pending.empty()) {
+        // no move wraps more cells than the bot covers
+        if (problem->bound && ticks + (pending.size() + bot.size() - 1) / bot.size() >= problem->bound) {
+            return 2;
+        }
+
         // fprintf(stderr, "at (%u,%u) pending %lu\n", POSX(bot[0]), POSY(bot[0]), pending.size());
-        auto path = find_closest(bot[0], pending, grid);
+        auto path = find_closest(bot[0], pending, grid, stats);
 
         #if 0
         string debug;
@@ -304,6 +412,7 @@ solve(Problem* problem, u32 ans_size, char* ans) {
             bot = move_bot(bot, m.x, m.y);
 
             ans_path.append(action_str(Action{action}));
+            ticks++;
 
             for (auto p : bot) {
                 pending.erase(p);
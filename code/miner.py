@@ -26,11 +26,11 @@ def dig_worker(infile, outfile):
     dig.solve(infile, outfile)
 
 
-def sol_worker(infile, outfile, program='walker', timeout=(30*60)):
+def sol_worker(infile, outfile, program='walker', timeout=(30*60), cache=True):
 
     def tworker(infile, outfile):
         trace('solving')
-        w = solver.Worker(program)
+        w = solver.Worker(program, cache=cache)
         return w.solve(infile, outfile)
 
     t = threading.Thread(target=tworker, args=(infile, outfile))
@@ -40,7 +40,7 @@ def sol_worker(infile, outfile, program='walker', timeout=(30*60)):
         trace(f'solver timed out ({timeout} sec)')
 
 
-def solve(block):
+def solve(block, cache=True, threads=False):
     trace('solving block')
 
     block_dir = pathlib.Path(_data_dir).joinpath(str(block['block']))
@@ -59,7 +59,9 @@ def solve(block):
     dig = threading.Thread(target=dig_worker, args=(puzzle_fn, puzzle_sol_fn))
     dig.start()
 
-    sol = multiprocessing.Process(target=sol_worker, args=(task_fn, task_sol_fn))
+    # a thread shares the libraries loaded for earlier blocks, the native solve does not hold the GIL
+    runner = threading.Thread if threads else multiprocessing.Process
+    sol = runner(target=sol_worker, args=(task_fn, task_sol_fn), kwargs=dict(cache=cache))
     sol.start()
     sol.join()
 
@@ -75,7 +77,7 @@ def solve(block):
     return ans
 
 
-def main(port, force=False):
+def main(port, force=False, cache=True, threads=False):
     server = Server(f'http://127.0.0.1:{port}')
 
     last_block = None
@@ -91,7 +93,7 @@ def main(port, force=False):
 
                 if needs_solve:
                     block = server.getblockinfo(info['block'])
-                    sol = solve(block)
+                    sol = solve(block, cache=cache, threads=threads)
                     trace('sol:', sol)
                     if sol:
                         trace('submit')
@@ -111,6 +113,8 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('-f', '--force-first', action='store_true', help='Solve the block at the start')
     parser.add_argument('-p', '--port', default=8332, help='Server port')
+    parser.add_argument('--no-cache', action='store_true', help='Always solve, ignore the solution cache')
+    parser.add_argument('-T', '--threads', action='store_true', help='Solve on a thread instead of a process per block')
     args = parser.parse_args()
 
-    main(port=args.port, force=args.force_first)
+    main(port=args.port, force=args.force_first, cache=not args.no_cache, threads=args.threads)
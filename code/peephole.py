@@ -0,0 +1,242 @@
+#!/usr/bin/env python
+import sys
+from collections import deque
+
+import numpy as np
+
+import simulator
+import solver
+
+
+def trace(*args, **kwargs):
+    print(*args, file=sys.stderr, flush=True, **kwargs)
+
+
+turns = {'E': 1, 'Q': -1}
+
+
+class Entry:
+    def __init__(self, state, boosted):
+        self.state = state
+        self.cells = list()
+        self.picked = False
+        self.boosted = boosted
+
+
+class Recorder(simulator.Simulator):
+    # logs per bot and action: state before it, cells it wrapped, booster pickups
+    def load(self, solution):
+        self.log = [list() for _ in solution]
+        self.finals = [None for _ in solution]
+        self.fixed = list()
+        super().load(solution)
+
+    def state(self, bot):
+        return (bot.pos, tuple(bot.manips))
+
+    def entry(self, i, bot):
+        if i < len(self.log) and bot.cursor > 0:
+            return self.log[i][bot.cursor - 1]
+
+    def wrap(self, i, bot):
+        e = self.entry(i, bot)
+        (e.cells if e else self.fixed).extend(self.reach(bot))
+        super().wrap(i, bot)
+
+    def pick(self, i, bot):
+        e = self.entry(i, bot)
+        if e and bot.pos in self.boosters:
+            e.picked = True
+        super().pick(i, bot)
+
+    def act(self, i, bot, action):
+        self.log[i].append(Entry(self.state(bot), bot.wheels > 0 or bot.drill > 0))
+        super().act(i, bot, action)
+
+
+def record(free, pos, boosters, routes):
+    sim = Recorder(free, pos, boosters)
+    sim.load(routes)
+    sim.run()
+    sim.finals = [sim.state(bot) for bot in sim.bots]
+    return sim
+
+
+class Coverage:
+    # how many actions wrap each cell, to tell which ones can go without losing coverage
+    def __init__(self, shape, sim):
+        self.count = np.zeros(shape, dtype=np.int32)
+        self.add(sim.fixed, 1)
+        for log in sim.log:
+            for e in log:
+                self.add(e.cells, 1)
+
+    def add(self, cells, n):
+        for x, y in cells:
+            self.count[y, x] += n
+
+    def spare(self, entries):
+        return all(self.count[y, x] > 1 for e in entries for x, y in e.cells)
+
+    def release(self, entries):
+        for e in entries:
+            self.add(e.cells, -1)
+        if all(self.count[y, x] > 0 for e in entries for x, y in e.cells):
+            return True
+        for e in entries:
+            self.add(e.cells, 1)
+        return False
+
+
+def movable(step):
+    a, e = step
+    return a[0] in 'WSADEQZ' and not e.picked and not e.boosted
+
+
+def trim_tail(steps, cover):
+    n = len(steps)
+    while n > 0 and movable(steps[n - 1]) and cover.release([steps[n - 1][1]]):
+        n -= 1
+    return steps[:n]
+
+
+def erase_loops(steps, cover, max_loop=64):
+    # drop detours that bring the bot back to the same position and orientation
+    # when everything they wrap is wrapped by some other action too
+    cut = [False] * len(steps)
+    seen = dict()
+    for k, (a, e) in enumerate(steps):
+        j = seen.get(e.state)
+        loop = [x for _, x in steps[j:k]] if j is not None and k - j <= max_loop else None
+        if loop and cover.spare(loop) and cover.release(loop):
+            for n in range(j, k):
+                cut[n] = True
+            seen = {s: n for s, n in seen.items() if n <= j}
+        else:
+            seen[e.state] = k
+        if not movable(steps[k]):
+            seen = dict()
+    return [x for x, c in zip(steps, cut) if not c]
+
+
+def shortest(free, a, b, limit):
+    w, h = free.shape[1], free.shape[0]
+    if a == b:
+        return []
+    prev = {a: None}
+    fringe = deque([(a, 0)])
+    while fringe:
+        p, d = fringe.popleft()
+        if d + 1 >= limit: break
+        for m, (dx, dy) in simulator.moves.items():
+            q = (p[0] + dx, p[1] + dy)
+            if q in prev or not (0 <= q[0] < w and 0 <= q[1] < h and free[q[1], q[0]]): continue
+            prev[q] = (p, m)
+            if q == b:
+                res = list()
+                while prev[q]:
+                    q, m = prev[q]
+                    res.append((m,))
+                return res[::-1]
+            fringe.append((q, d + 1))
+
+
+def shorten_runs(free, steps, final, cover, min_run=4):
+    # replace stretches of redundant moves by a shortest path plus the net rotation
+    res = list()
+    k = 0
+    while k < len(steps):
+        j = k
+        while j < len(steps) and movable(steps[j]) and cover.spare([steps[j][1]]):
+            j += 1
+        if j - k < min_run:
+            res.append(steps[k][0])
+            k += 1
+            continue
+        run = [a for a, _ in steps[k:j]]
+        r = sum(turns.get(a[0], 0) for a in run) % 4
+        rot = [('E',)] * r if r < 3 else [('Q',)]
+        end = steps[j][1].state if j < len(steps) else final
+        path = shortest(free, steps[k][1].state[0], end[0], len(run) - len(rot))
+        if path is not None and cover.release([e for _, e in steps[k:j]]):
+            run = rot + path
+        res += run
+        k = j
+    return res
+
+
+def optimize(free, pos, boosters, solution, rounds=3):
+    routes = simulator.parse_solution(solution) if isinstance(solution, str) else solution
+
+    def attempt(base, edits, best):
+        cand = list(base)
+        for i, x in edits:
+            cand[i] = x
+        t = simulator.score(free, pos, boosters, cand)
+        if t is not None and t <= best:
+            return cand
+        if len(edits) == 1:
+            return base
+        m = len(edits) // 2
+        return attempt(attempt(base, edits[:m], best), edits[m:], best)
+
+    changed = False
+    for _ in range(rounds):
+        try:
+            sim = record(free, pos, boosters, routes)
+        except simulator.SimulationError as e:
+            trace(e)
+            break
+        if not sim.complete():
+            break
+        cover = Coverage(free.shape, sim)
+        edits = list()
+        for i, route in enumerate(routes):
+            steps = list(zip(route, sim.log[i]))
+            steps = trim_tail(steps, cover)
+            steps = erase_loops(steps, cover)
+            x = shorten_runs(free, steps, sim.finals[i], cover)
+            if len(x) < len(route):
+                edits.append((i, x))
+        if not edits:
+            break
+
+        cand = attempt(routes, edits, sim.time)
+        if cand == routes:
+            break
+        routes = cand
+        changed = True
+
+    if isinstance(solution, str) and not changed:
+        return solution
+    return simulator.dump_solution(routes)
+
+
+def optimize_board(board, grid, solution):
+    free = simulator.grid_mask(grid, board.size)
+    return optimize(free, board.pos, board.boosters, solution)
+
+
+def main(infile, solfile, outfile=None):
+    with open(infile) as f:
+        board = solver.Board.load(f)
+    with open(solfile) as f:
+        ans = f.read().strip()
+    res = optimize_board(board, board.gen_grid(), ans)
+    trace(f'{len(ans)} -> {len(res)}')
+    if outfile:
+        with open(outfile, 'w') as f:
+            f.write(res)
+    else:
+        print(res)
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('infile', help='Problem description')
+    parser.add_argument('solution', help='Solution file')
+    parser.add_argument('outfile', nargs='?', help='Output file')
+    args = parser.parse_args()
+
+    main(args.infile, args.solution, args.outfile)
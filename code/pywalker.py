@@ -0,0 +1,213 @@
+#!/usr/bin/env python
+import sys
+import time
+
+import numpy as np
+
+import simulator
+
+
+def trace(*args, **kwargs):
+    print(*args, file=sys.stderr, flush=True, **kwargs)
+
+
+steps = [('W', 0, 1), ('S', 0, -1), ('A', -1, 0), ('D', 1, 0)]
+
+
+def new_stats():
+    # same fields as the native solvers fill in, see solver.CStats
+    return dict(nodes=0, bfs_calls=0, path_calls=0, peak_alloc=0,
+        phases=dict(setup=0.0, closest=0.0, path=0.0, apply=0.0), boosters=dict())
+
+
+def nearest(free, todo, pos, radius=8, stats=None):
+    # BFS in a window around pos, growing it until the nearest todo cell is provably inside
+    h, w = free.shape
+    px, py = pos
+    while True:
+        x0, x1 = max(0, px - radius), min(w, px + radius + 1)
+        y0, y1 = max(0, py - radius), min(h, py + radius + 1)
+        whole = x0 == 0 and y0 == 0 and x1 == w and y1 == h
+        fw = free[y0:y1, x0:x1]
+        tw = todo[y0:y1, x0:x1]
+        dist = np.full(fw.shape, -1, dtype=np.int32)
+        frontier = np.zeros(fw.shape, dtype=bool)
+        frontier[py - y0, px - x0] = True
+        if stats is not None:
+            stats['bfs_calls'] += 1
+            # dist, frontier, next frontier and hit
+            stats['peak_alloc'] = max(stats['peak_alloc'], dist.nbytes + 3 * frontier.nbytes)
+        dist[frontier] = 0
+        d = 0
+        found = None
+        while frontier.any():
+            d += 1
+            if d > radius and not whole:
+                break
+            nb = np.zeros_like(frontier)
+            nb[1:, :] |= frontier[:-1, :]
+            nb[:-1, :] |= frontier[1:, :]
+            nb[:, 1:] |= frontier[:, :-1]
+            nb[:, :-1] |= frontier[:, 1:]
+            nb &= fw & (dist < 0)
+            dist[nb] = d
+            if stats is not None:
+                stats['nodes'] += int(frontier.sum())
+            hit = nb & tw
+            if hit.any():
+                found = hit
+                break
+            frontier = nb
+
+        if found is not None:
+            ys, xs = np.nonzero(found)
+            if stats is None:
+                return path(dist, (xs[0], ys[0])), (x0 + xs[0], y0 + ys[0])
+            t = time.perf_counter()
+            res = path(dist, (xs[0], ys[0]))
+            stats['path_calls'] += 1
+            stats['phases']['path'] += time.perf_counter() - t
+            return res, (x0 + xs[0], y0 + ys[0])
+        if whole:
+            return None, None
+        radius *= 2
+
+
+def path(dist, target):
+    h, w = dist.shape
+    x, y = target
+    res = list()
+    heading = None
+    while dist[y, x] > 0:
+        d = dist[y, x]
+        prev = None
+        for s in steps:
+            qx, qy = x - s[1], y - s[2]
+            if 0 <= qx < w and 0 <= qy < h and dist[qy, qx] == d - 1:
+                prev = (s, qx, qy)
+                if s[0] == heading: break
+        s, x, y = prev
+        heading = s[0]
+        res.append(s)
+    return res[::-1]
+
+
+class Walker:
+    def __init__(self, free, pos, rotation, boosters, stats=None):
+        self.free = free
+        self.wrapped = np.zeros_like(free)
+        self.pos = tuple(pos)
+        self.manips = [(1, 0), (1, 1), (1, -1)]
+        self.arm = [(1, 2), (1, -2)]
+        for _ in range(rotation % 4):
+            self.manips = [(dy, -dx) for dx, dy in self.manips]
+            self.arm = [(dy, -dx) for dx, dy in self.arm]
+        self.boosters = {tuple(p): t for t, p in boosters if t == 'B'}
+        self.bag = 1 if self.boosters.pop(self.pos, None) else 0
+        self.actions = list()
+        self.bounded = False
+        self.stats = stats
+        self.wrap()
+
+    def reach(self):
+        # manipulator offsets as arrays, cells kept when in bounds, free and in sight
+        h, w = self.free.shape
+        bx, by = self.pos
+        m = np.array(self.manips)
+        xs, ys = m[:, 0] + bx, m[:, 1] + by
+        ok = (xs >= 0) & (xs < w) & (ys >= 0) & (ys < h)
+        ok[ok] = self.free[ys[ok], xs[ok]]
+        for i in np.nonzero(ok)[0]:
+            for x, y in simulator.sightline(*self.manips[i]):
+                x, y = bx + x, by + y
+                if not (0 <= x < w and 0 <= y < h and self.free[y, x]):
+                    ok[i] = False
+                    break
+        return xs[ok], ys[ok]
+
+    def wrap(self):
+        xs, ys = self.reach()
+        self.wrapped[ys, xs] = True
+        self.wrapped[self.pos[1], self.pos[0]] = True
+
+    def attach(self):
+        dx, dy = self.arm.pop(0)
+        self.manips.append((dx, dy))
+        sx, sy = (dx > 0) - (dx < 0), (dy > 0) - (dy < 0)
+        if abs(dy) > abs(dx):
+            self.arm.append((dx, dy + sy))
+        else:
+            self.arm.append((dx + sx, dy))
+        self.bag -= 1
+        if self.stats is not None:
+            self.stats['boosters']['B'] = self.stats['boosters'].get('B', 0) + 1
+        self.actions.append(f'B({dx},{dy})')
+        self.wrap()
+
+    def step(self, s):
+        a, dx, dy = s
+        self.pos = (self.pos[0] + dx, self.pos[1] + dy)
+        self.actions.append(a)
+        if self.boosters.pop(self.pos, None):
+            self.bag += 1
+        self.wrap()
+
+    def lower_bound(self, todo):
+        # no step wraps more than every manipulator could
+        rate = len(self.manips) + 1 + self.bag + len(self.boosters)
+        return -(-int(todo.sum()) // rate)
+
+    def run(self, limit=None, bound=None):
+        while True:
+            if self.bag:
+                self.attach()
+            todo = self.free & ~self.wrapped
+            if bound and len(self.actions) + self.lower_bound(todo) >= bound:
+                self.bounded = True
+                return
+            if self.stats is None:
+                route, target = nearest(self.free, todo, self.pos)
+            else:
+                t = time.perf_counter()
+                route, target = nearest(self.free, todo, self.pos, stats=self.stats)
+                self.stats['phases']['closest'] += time.perf_counter() - t
+            if route is None:
+                break
+            for s in route:
+                self.step(s)
+                if self.bag or self.wrapped[target[1], target[0]]:
+                    break
+            if limit and len(self.actions) > limit:
+                return
+        return ''.join(self.actions)
+
+
+class Solver:
+    def __init__(self, name='pywalker', stats=False):
+        self.name = name
+        self.bounded = False
+        self.collect = stats
+        self.stats = None
+
+    def encode(self, state):
+        return state
+
+    def run(self, state, ans_len):
+        stats = new_stats() if self.collect else None
+        t = time.perf_counter()
+        free = simulator.grid_mask(state.grid, state.mine_size)
+        walker = Walker(free, state.pos, state.rotation, state.boosters, stats=stats)
+        if stats is not None:
+            stats['phases']['setup'] = time.perf_counter() - t
+        ans = walker.run(limit=ans_len, bound=state.bound)
+        self.bounded = walker.bounded
+        if stats is not None:
+            phases = stats['phases']
+            phases['apply'] = time.perf_counter() - t - phases['setup'] - phases['closest']
+            self.stats = stats
+        return ans
+
+    def solve(self, state):
+        cx = self.encode(state)
+        ans_len = state.mine_size[0] * state.mine_size[1] * 2
+        return self.run(cx, ans_len)
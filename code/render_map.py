@@ -1,8 +1,17 @@
 #!/usr/bin/env python
+import html
+import io
+import multiprocessing
 import os
+import pathlib
 import re
 import sys
-from PIL import Image, ImageDraw
+import zipfile
+from collections import Counter
+import numpy as np
+from PIL import Image, ImageColor, ImageDraw
+
+import simulator
 
 
 def trace(*args, **kwargs):
@@ -58,8 +67,30 @@ class Puzzle:
         self.exclude_pos = exclude_pos
 
 
+def rasterize(paths, size):
+    w, h = size
+    acc = np.zeros((h + 1, w + 1), dtype=np.int32)
+    for label, path in enumerate(paths, 1):
+        xs = np.array([x for x,y in path])
+        ys = np.array([y for x,y in path])
+        nxs = np.roll(xs, -1)
+        nys = np.roll(ys, -1)
+        area = np.sum(xs * nys - nxs * ys)
+        vert = (xs == nxs) & (ys != nys)
+        v = -label * np.sign(nys[vert] - ys[vert]) * np.sign(area)
+        x = xs[vert]
+        np.add.at(acc, (np.minimum(ys[vert], nys[vert]), x), v)
+        np.add.at(acc, (np.maximum(ys[vert], nys[vert]), x), -v)
+    return np.cumsum(np.cumsum(acc, axis=0), axis=1)[:h, :w]
+
+
+def board_mask(board):
+    return (rasterize([board.board], board.size) != 0) & (rasterize(board.obstacles, board.size) == 0)
+
+
 class Renderer:
-    def __init__(self):
+    def __init__(self, fit=None):
+        self.fit = fit
         self.booster_color = {
             'B': '#fecb45',
             'C': '#3a9bfc',
@@ -68,91 +99,353 @@ class Renderer:
             'R': '#9373d8',
             'X': '#0b24fb',
         }
-
-    def render_board(self, board, target_fn, cell_size=None):
-        w, h = board.size
+        self.palette = list()
+        self._stamps = dict()
+
+    def ink(self, color):
+        color = ImageColor.getrgb(color)
+        if color not in self.palette:
+            self.palette.append(color)
+        return self.palette.index(color)
+
+    def cell_size(self, size):
+        w, h = size
+        cell_size = max(5, 800 // max(w, h))
+        cell_size += (1 - cell_size % 2)
+        return cell_size
+
+    def stamp(self, shape, r, outline, fill, cell_size):
+        key = (shape, r, outline, fill, cell_size)
+        stamp = self._stamps.get(key)
+        if stamp is not None:
+            return stamp
+
+        n = cell_size + 1
+        layers = list()
+        for color, kwargs in [(fill, dict(fill='white')), (outline, dict(outline='white'))]:
+            if color is None: continue
+            with Image.new('L', (n, n)) as im:
+                draw = ImageDraw.Draw(im)
+                if shape == 'cell':
+                    w = (1 - r) * cell_size / 2
+                    draw.rectangle([(w, w), (cell_size - w, cell_size - w)], **kwargs)
+                else:
+                    r0, r1 = int(round((1 - r) / 2 * cell_size)), int(round((1 + r) / 2 * cell_size))
+                    px = [(r0, r0), (r1, r1)]
+                    if shape == 'circle':
+                        draw.ellipse(px, **kwargs)
+                    else:
+                        draw.rectangle(px, **kwargs)
+                dy, dx = np.nonzero(np.asarray(im))
+            layers.append((dy, dx, self.ink(color)))
+
+        self._stamps[key] = layers
+        return layers
+
+    def blit(self, im, cells, stamp, cell_size):
+        cells = np.asarray(cells, dtype=np.intp).reshape(-1, 2)
+        if not len(cells): return
+        x = cells[:,0:1] * cell_size
+        y = cells[:,1:2] * cell_size
+        h, w = im.shape[:2]
+        for dy, dx, color in stamp:
+            ys, xs = y + dy, x + dx
+            # cells past the edge are clipped, not wrapped around
+            ok = (ys >= 0) & (ys < h) & (xs >= 0) & (xs < w)
+            im[ys[ok], xs[ok]] = color
+
+    def upscale(self, cells, cell_size):
+        h, w = cells.shape
+        im = np.pad(cells, ((0, 1), (0, 1)), mode='edge')
+        im = np.repeat(np.repeat(im, cell_size, axis=0), cell_size, axis=1)
+        return np.ascontiguousarray(im[:h*cell_size+1, :w*cell_size+1])
+
+    def outline(self, im, labels, color, cell_size):
+        pad = np.pad(labels, 1)
+        color = self.ink(color)
+        span = np.arange(cell_size + 1)
+
+        ys, xs = np.nonzero(pad[:-1, 1:-1] != pad[1:, 1:-1])
+        im[(ys * cell_size)[:,None], (xs * cell_size)[:,None] + span] = color
+
+        ys, xs = np.nonzero(pad[1:-1, :-1] != pad[1:-1, 1:])
+        im[(ys * cell_size)[:,None] + span, (xs * cell_size)[:,None]] = color
+
+    def background(self, size):
+        w, h = size
+        return np.full((h, w), self.ink('#f7f0e9'), dtype=np.uint8)
+
+    def map_image(self, board, cell_size):
+        mine = rasterize([board.board], board.size)
+        obstacles = rasterize(board.obstacles, board.size)
+
+        cells = self.background(board.size)
+        cells[mine != 0] = self.ink('white')
+        cells[obstacles != 0] = self.ink('#cccccc')
+
+        im = self.upscale(cells, cell_size)
+        self.outline(im, mine, '#8b8b8b', cell_size)
+        self.outline(im, obstacles, '#333333', cell_size)
+        return cells, im
+
+    def board_image(self, board, cell_size):
+        _, im = self.map_image(board, cell_size)
+
+        px, py = board.pos
+        self.blit(im, [(px, py), (px+1, py), (px+1, py-1), (px+1, py+1)],
+            self.stamp('cell', 0.98, None, '#ecb229', cell_size), cell_size)
+
+        for b, color in self.booster_color.items():
+            cells = [p for t, p in board.boosters if t == b]
+            self.blit(im, cells, self.stamp('circle', 0.65, '#cccccc', color, cell_size), cell_size)
+
+        self.blit(im, [board.pos], self.stamp('circle', 0.34, '#cccccc', '#fc0d1b', cell_size), cell_size)
+        return im
+
+    def redraw(self, im, base, fills, sim, region, cell_size):
+        xs, ys = np.array(sorted(region), dtype=np.intp).reshape(-1, 2).T
+        if not len(xs): return
+
+        fill = fills[ys, xs]
+        color = np.where(sim.free[ys, xs], self.ink('white'), fill)
+        color = np.where(sim.wrapped[ys, xs], self.ink('#fbe9a9'), color)
+
+        span = np.arange(cell_size + 1)
+        y = (ys * cell_size)[:,None,None] + span[None,:,None]
+        x = (xs * cell_size)[:,None,None] + span[None,None,:]
+        block = base[y, x]
+        im[y, x] = np.where(block == fill[:,None,None], color[:,None,None], block)
+
+        for b, color in self.booster_color.items():
+            cells = [p for p in region if sim.boosters.get(p) == b]
+            if b == 'X':
+                cells = [p for p in region if p in sim.spawns]
+            self.blit(im, cells, self.stamp('circle', 0.65, '#cccccc', color, cell_size), cell_size)
+
+        cells = [p for p in region if p in sim.beacons]
+        self.blit(im, cells, self.stamp('rect', 0.5, '#cccccc', self.booster_color['R'], cell_size), cell_size)
+
+        cells = [p for bot in sim.bots for p in sim.reach(bot)]
+        self.blit(im, cells, self.stamp('cell', 0.98, None, '#ecb229', cell_size), cell_size)
+
+        cells = [bot.pos for bot in sim.bots]
+        self.blit(im, cells, self.stamp('circle', 0.34, '#cccccc', '#fc0d1b', cell_size), cell_size)
+
+    def replay(self, board, solution, cell_size, every=None):
+        routes = simulator.parse_solution(solution)
+        if every is None:
+            every = max(1, max(len(x) for x in routes) // 200)
+
+        fills, base = self.map_image(board, cell_size)
+        sim = simulator.Simulator(board_mask(board), board.pos, board.boosters)
+        sim.load(routes)
+
+        im = base.copy()
+        for b, color in self.booster_color.items():
+            self.stamp('circle', 0.65, '#cccccc', color, cell_size)
+        self.stamp('rect', 0.5, '#cccccc', self.booster_color['R'], cell_size)
+        self.stamp('cell', 0.98, None, '#ecb229', cell_size)
+        self.stamp('circle', 0.34, '#cccccc', '#fc0d1b', cell_size)
+        self.ink('#fbe9a9')
+
+        def bot_cells():
+            return {p for bot in sim.bots for p in sim.reach(bot)}
+
+        region = {p for t, p in board.boosters} | sim.flush()
+        last = bot_cells()
+        self.redraw(im, base, fills, sim, region | last, cell_size)
+        yield im
+
+        for t in sim.replay():
+            if t % every and sim.running: continue
+            bots = bot_cells()
+            self.redraw(im, base, fills, sim, sim.flush() | sim.beacons | last | bots, cell_size)
+            last = bots
+            yield im
+
+        if not sim.complete():
+            trace(f'incomplete at time {sim.time}')
+
+    def render_replay(self, board, solution, target_fn, cell_size=None, every=None, duration=40):
         if cell_size is None:
-            cell_size = max(5, 800 // max(w, h))
-            cell_size += (1 - cell_size % 2)
-        w *= cell_size
-        h *= cell_size
-
-        with Image.new('RGB', (w+1, h+1), color='#f7f0e9') as im:
-            draw = ImageDraw.Draw(im)
-
-            def poly(path, outline, fill=None):
-                px = [(x * cell_size, y * cell_size) for x,y in path]
-                draw.polygon(px, outline=outline, fill=fill)
-
-            def rect(at, r, outline, fill=None):
-                x, y = at
-                x, y = x * cell_size, y * cell_size
-                r0, r1 = int(round((1 - r) / 2 * cell_size)), int(round((1 + r) / 2 * cell_size))
-                px = [(x + r0, y + r0), (x + r1, y + r1)]
-                draw.rectangle(px, outline=outline, fill=fill)
-
-            def circle(at, r, outline, fill=None):
-                x, y = at
-                x, y = x * cell_size, y * cell_size
-                r0, r1 = int(round((1 - r) / 2 * cell_size)), int(round((1 + r) / 2 * cell_size))
-                px = [(x + r0, y + r0), (x + r1, y + r1)]
-                draw.ellipse(px, outline=outline, fill=fill)
-
-            def cells(cells, r, fill):
-                w = (1 - r) * cell_size / 2
-                for x, y in cells:
-                    x, y = x * cell_size, y * cell_size
-                    px = [((x + w), y + w), (x + cell_size - w, y + cell_size - w)]
-                    draw.rectangle(px, outline=None, fill=fill)
-
-            poly(board.board, '#8b8b8b', 'white')
+            cell_size = self.cell_size(board.size)
+        frames = self.replay(board, solution, cell_size, every=every)
 
-            for p in board.obstacles:
-                poly(p, '#333333', '#cccccc')
+        if os.path.isdir(target_fn):
+            for i, im in enumerate(frames):
+                self.save(im, os.path.join(target_fn, f'frame-{i:05}.png'))
+            return
 
-            px, py = board.pos
-            cells([(px, py), (px+1, py), (px+1, py-1), (px+1, py+1)], 0.98, '#ecb229')
+        frames = [self.image(im) for im in frames]
+        frames[0].save(target_fn, save_all=True, append_images=frames[1:], duration=duration, loop=0, optimize=False)
 
-            for b, p in board.boosters:
-                circle(p, 0.65, '#cccccc', self.booster_color[b])
-
-            circle(board.pos, 0.34, '#cccccc', '#fc0d1b')
+    def render_solved(self, board, solution, target_fn, cell_size=None):
+        if cell_size is None:
+            cell_size = self.cell_size(board.size)
+        for im in self.replay(board, solution, cell_size, every=sys.maxsize):
+            pass
+        self.save(im, target_fn)
+
+    def puzzle_image(self, puzzle, cell_size):
+        im = self.upscale(self.background(puzzle.size), cell_size)
+        self.blit(im, puzzle.include_pos, self.stamp('rect', 1, '#8b8b8b', 'white', cell_size), cell_size)
+        self.blit(im, puzzle.exclude_pos, self.stamp('rect', 1, '#333333', '#cccccc', cell_size), cell_size)
+        return im
+
+    def image(self, im):
+        res = Image.fromarray(np.flipud(im))
+        res.putpalette([c for rgb in self.palette for c in rgb])
+        return res
+
+    def save(self, im, target_fn):
+        with self.image(im) as im:
+            if self.fit and max(im.size) > self.fit:
+                # a pixel per cell is still too big, scale down to fit
+                with im.convert('RGB') as x:
+                    x.thumbnail((self.fit, self.fit), Image.LANCZOS)
+                    x.save(target_fn)
+                return
+            im.save(target_fn)
 
-            im.transpose(Image.FLIP_TOP_BOTTOM).save(target_fn)
+    def render_board(self, board, target_fn, cell_size=None):
+        if cell_size is None:
+            cell_size = self.cell_size(board.size)
+        self.save(self.board_image(board, cell_size), target_fn)
 
     def render_puzzle(self, puzzle, target_fn, cell_size=None):
-        w, h = puzzle.size
         if cell_size is None:
-            cell_size = max(5, 800 // max(w, h))
-            cell_size += (1 - cell_size % 2)
-        w *= cell_size
-        h *= cell_size
-
-        with Image.new('RGB', (w+1, h+1), color='#f7f0e9') as im:
-            draw = ImageDraw.Draw(im)
-
-            def rect(at, r, outline, fill=None):
-                x, y = at
-                x, y = x * cell_size, y * cell_size
-                r0, r1 = int(round((1 - r) / 2 * cell_size)), int(round((1 + r) / 2 * cell_size))
-                px = [(x + r0, y + r0), (x + r1, y + r1)]
-                draw.rectangle(px, outline=outline, fill=fill)
-
-            for p in puzzle.include_pos:
-                rect(p, 1, '#8b8b8b', 'white')
-
-            for p in puzzle.exclude_pos:
-                rect(p, 1, '#333333', '#cccccc')
-
-            im.transpose(Image.FLIP_TOP_BOTTOM).save(target_fn)
-
-
-def main(infile, outfile):
+            cell_size = self.cell_size(puzzle.size)
+        self.save(self.puzzle_image(puzzle, cell_size), target_fn)
+
+
+def open_source(src):
+    if isinstance(src, tuple):
+        fn, member = src
+        with zipfile.ZipFile(fn) as z:
+            return io.StringIO(z.read(member).decode('utf8'))
+    return open(src)
+
+
+def source_mtime(src):
+    if isinstance(src, tuple):
+        src = src[0]
+    return os.path.getmtime(src)
+
+
+def walk_specs(specs):
+    files = {'.desc': list(), '.cond': list(), '.sol': list()}
+    for spec in specs:
+        if zipfile.is_zipfile(spec):
+            with zipfile.ZipFile(spec) as z:
+                srcs = [(pathlib.PurePosixPath(x), (spec, x)) for x in z.namelist()]
+        else:
+            srcs = [(x.relative_to(spec), str(x)) for x in pathlib.Path(spec).glob('**/*')]
+        for fn, src in srcs:
+            if fn.suffix in files:
+                files[fn.suffix].append((spec, '-'.join(fn.with_suffix('').parts), fn.stem, src))
+
+    def unique(xs):
+        res = dict()
+        for k, v in xs:
+            res[k] = v if k not in res else None
+        return res
+
+    sols = files['.sol']
+    same_spec = {(spec, name): src for spec, name, _, src in sols}
+    by_name = unique((name, src) for _, name, _, src in sols)
+    by_stem = unique((stem, src) for _, _, stem, src in sols)
+
+    for suffix, tx in [('.desc', 'task'), ('.cond', 'puzzle')]:
+        # a name found in several specs gets the spec as a prefix, so no image overwrites another
+        count = Counter(name for _, name, _, _ in files[suffix])
+        res = list()
+        for spec, name, stem, src in files[suffix]:
+            sol = None
+            if tx == 'task':
+                sol = same_spec.get((spec, name)) or by_name.get(name) or by_stem.get(stem)
+            if count[name] > 1:
+                name = f'{pathlib.Path(spec).stem}-{name}'
+            res.append((name, tx, src, sol))
+        yield from sorted(res, key=lambda x: x[0])
+
+
+def render_job(job):
+    (name, tx, src, sol, targetdir, thumb, force) = job
+    images = [os.path.join(targetdir, f'{name}-{tx}.png')]
+    if sol:
+        images.append(os.path.join(targetdir, f'{name}-solved.png'))
+
+    inputs = [src, sol] if sol else [src]
+    mtime = max(source_mtime(x) for x in inputs)
+    if not force and all(os.path.isfile(x) and os.path.getmtime(x) >= mtime for x in images):
+        return (name, images, None)
+
+    status = tx
+    try:
+        with open_source(src) as f:
+            obj = (Board if tx == 'task' else Puzzle).load(f)
+
+        r = Renderer(fit=thumb)
+        cell_size = r.cell_size(obj.size)
+        if thumb:
+            cell_size = max(1, thumb // max(obj.size))
+
+        if tx == 'task':
+            r.render_board(obj, images[0], cell_size=cell_size)
+        else:
+            r.render_puzzle(obj, images[0], cell_size=cell_size)
+        if sol:
+            with open_source(sol) as f:
+                r.render_solved(obj, f.read(), images[1], cell_size=cell_size)
+            status = 'solved'
+    except Exception as e:
+        status = f'error: {e}'
+        trace(name, status)
+    return (name, images, status)
+
+
+def contact_sheet(results, target_fn, thumb=None):
+    width = thumb or 240
+    rows = list()
+    for name, images, status in sorted(results):
+        imgs = ''.join(
+            f'<a href="{html.escape(os.path.basename(x))}"><img src="{html.escape(os.path.basename(x))}" width="{width}"></a>'
+            for x in images if os.path.isfile(x))
+        caption = html.escape(name if status is None else f'{name} ({status})')
+        rows.append(f'<figure>{imgs}<figcaption>{caption}</figcaption></figure>')
+
+    with open(target_fn, 'w') as f:
+        f.write('<!doctype html>\n<html><head><meta charset="utf-8"><title>render_map</title>\n')
+        f.write('<style>body{font:12px sans-serif;background:#f7f0e9} figure{display:inline-block;margin:4px;vertical-align:top} img{margin-right:2px}</style>\n')
+        f.write('</head><body>\n')
+        f.write('\n'.join(rows))
+        f.write('\n</body></html>\n')
+
+
+def batch(specs, targetdir, thumb=None, jobs=None, force=False):
+    os.makedirs(targetdir, exist_ok=True)
+    work = [x + (targetdir, thumb, force) for x in walk_specs(specs)]
+
+    results = list()
+    with multiprocessing.Pool(jobs) as pool:
+        for res in pool.imap_unordered(render_job, work):
+            if res[2] is not None:
+                trace(res[1][-1])
+            results.append(res)
+
+    sheet = os.path.join(targetdir, 'index.html')
+    contact_sheet(results, sheet, thumb=thumb)
+    trace(sheet)
+
+
+def main(infile, outfile, solution=None, every=None):
     trace(infile.name)
     n, ext = os.path.splitext(infile.name)
     n = os.path.basename(n)
 
-    if ext == '.desc':
+    if solution:
+        tx = 'replay'
+    elif ext == '.desc':
         tx = 'task'
     elif ext == '.cond':
         tx = 'puzzle'
@@ -160,7 +453,7 @@ def main(infile, outfile):
         raise Exception(ext)
 
     if not outfile:
-        outfile = os.path.join('.', f'{n}-{tx}.png')
+        outfile = os.path.join('.', f'{n}-{tx}.gif' if tx == 'replay' else f'{n}-{tx}.png')
     trace(outfile)
 
     r = Renderer()
@@ -171,6 +464,9 @@ def main(infile, outfile):
     elif tx == 'puzzle':
         puz = Puzzle.load(infile)
         r.render_puzzle(puz, outfile)
+    elif tx == 'replay':
+        board = Board.load(infile)
+        r.render_replay(board, solution.read(), outfile, every=every)
     else:
         raise Exception(tx)
 
@@ -178,8 +474,18 @@ def main(infile, outfile):
 if __name__ == '__main__':
     import argparse
     parser = argparse.ArgumentParser()
+    parser.add_argument('-s', '--solution', type=argparse.FileType('r'), help='Replay solution (.sol) into GIF/APNG or a directory of frames')
+    parser.add_argument('-e', '--every', type=int, help='Time units per replay frame')
+    parser.add_argument('-b', '--batch', metavar='SPEC', nargs='+', help='Render directories or zip archives')
+    parser.add_argument('-r', '--targetdir', metavar='DIR', default='.', help='Target directory for batch mode')
+    parser.add_argument('-t', '--thumb', type=int, metavar='PX', help='Thumbnail size in batch mode')
+    parser.add_argument('-j', '--jobs', type=int, help='Number of processes in batch mode')
+    parser.add_argument('-f', '--force', action='store_true', help='Render up-to-date outputs in batch mode')
     parser.add_argument('infile', nargs='?', type=argparse.FileType('r'), default=sys.stdin)
     parser.add_argument('outfile', nargs='?')
     args = parser.parse_args()
 
-    main(args.infile, outfile=args.outfile)
+    if args.batch:
+        batch(args.batch, args.targetdir, thumb=args.thumb, jobs=args.jobs, force=args.force)
+    else:
+        main(args.infile, outfile=args.outfile, solution=args.solution, every=args.every)
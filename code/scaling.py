@@ -0,0 +1,324 @@
+#!/usr/bin/env python
+import csv
+import io
+import math
+import multiprocessing
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+
+import digger
+import solver
+
+
+def trace(*args, **kwargs):
+    print(*args, file=sys.stderr, flush=True, **kwargs)
+
+
+_scaling_dir = os.path.join(os.path.dirname(__file__), '../data/scaling')
+
+SIZES = [50, 100, 200, 300, 500, 750, 1000, 1200]
+STAGES = ['dig', 'parse', 'gen_grid', 'features', 'marshal', 'solve', 'optimize', 'score']
+
+# booster mix of the chain puzzle examples
+_booster_mix = dict(B=6, F=10, L=5, R=1, C=3, X=4)
+
+_colors = ['#1f77b4', '#ff7f0e', '#2ca02c', '#d62728', '#9467bd', '#8c564b', '#e377c2', '#7f7f7f']
+
+
+class StopStage(Exception): pass
+
+
+def make_puzzle(tsize, seed=0, vertices=None, boosters=1.0):
+    # every excluded point digs a tendril in from the nearest side, about four outline vertices each;
+    # included points sit in the middle half so the tendrils stay short of them
+    rnd = random.Random(f'{seed}:{tsize}')
+    vertices = vertices or tsize
+    lo, hi = tsize // 4, max(tsize // 4 + 1, 3 * tsize // 4)
+    include = set()
+    while len(include) < max(1, tsize // 10):
+        include.add((rnd.randrange(lo, hi), rnd.randrange(lo, hi)))
+    exclude = set()
+    while len(exclude) < max(1, vertices // 4 - 1):
+        p = (rnd.randrange(tsize), rnd.randrange(tsize))
+        if p not in include:
+            exclude.add(p)
+    # boosters per thousand cells of the square, split the way the examples do
+    total = boosters * tsize * tsize / 1000
+    n = sum(_booster_mix.values())
+    counts = [round(total * w / n) for w in _booster_mix.values()]
+    return digger.Puzzle(0, 0, tsize, 4, 4 * tsize * tsize, *counts, sorted(include), sorted(exclude))
+
+
+def generate(puzzle, seed=0):
+    random.seed(f'{seed}:{puzzle.tsize}')
+    return digger.Generator().generate(puzzle)
+
+
+def map_name(tsize, seed=0):
+    return f'scale-{tsize:04}-{seed}'
+
+
+def gen(outdir=None, sizes=SIZES, seed=0, vertices=None, boosters=1.0):
+    outdir = outdir or _scaling_dir
+    os.makedirs(outdir, exist_ok=True)
+    for tsize in sizes:
+        puz = make_puzzle(tsize, seed=seed, vertices=vertices, boosters=boosters)
+        board = generate(puz, seed=seed)
+        fn = os.path.join(outdir, map_name(tsize, seed))
+        with open(fn + '.cond', 'w') as f:
+            f.write(puz.dumps())
+        board.save(fn + '.desc')
+        trace(f'{fn}.desc  {len(board.outline)} vertices, {len(board.boosters)} boosters')
+
+
+def run_stages(tsize, seed, vertices, boosters, program, stop, max_rss, conn):
+    # streams every stage as it ends, so a map that runs out of time still reports the stages before
+    import peephole
+    import selector
+    import simulator
+
+    if max_rss:
+        resource.setrlimit(resource.RLIMIT_AS, (max_rss, max_rss))
+
+    def stage(name, fn):
+        rss = solver.peak_rss()
+        t = time.perf_counter()
+        res = fn()
+        t = time.perf_counter() - t
+        x = solver.peak_rss()
+        conn.send((name, dict(time=t, rss=x, rss_growth=x - rss)))
+        if name == stop:
+            raise StopStage()
+        return res
+
+    try:
+        puz = make_puzzle(tsize, seed=seed, vertices=vertices, boosters=boosters)
+        dug = stage('dig', lambda: generate(puz, seed=seed))
+        conn.send(('meta', dict(vertices=len(dug.outline), boosters=len(dug.boosters))))
+        with tempfile.TemporaryDirectory() as tmp:
+            fn = os.path.join(tmp, 'task.desc')
+            dug.save(fn)
+            with open(fn) as f:
+                text = f.read()
+        del dug
+
+        board = stage('parse', lambda: solver.Board.load(io.StringIO(text)))
+        grid = stage('gen_grid', board.gen_grid)
+        conn.send(('meta', dict(cells=len(grid))))
+        stage('features', lambda: selector.features(board, grid))
+
+        state = solver.State(mine_size=board.size, pos=board.pos, rotation=0, grid=grid, boosters=board.boosters)
+        sol = solver.open_solver(program, stats=True)
+        cx = stage('marshal', lambda: sol.encode(state))
+        ans = stage('solve', lambda: sol.run(cx, board.size[0] * board.size[1] * 2))
+        if sol.stats:
+            conn.send(('meta', dict(nodes=sol.stats['nodes'], peak_alloc=sol.stats['peak_alloc'])))
+        if not ans:
+            conn.send(('failed', dict(error='no solution')))
+            return
+        ans = stage('optimize', lambda: peephole.optimize_board(board, grid, ans))
+        n = stage('score', lambda: simulator.score(simulator.grid_mask(grid, board.size), board.pos, board.boosters, ans))
+        conn.send(('meta', dict(score=n)))
+    except StopStage:
+        pass
+    except MemoryError:
+        conn.send(('failed', dict(error='out of memory')))
+        return
+    conn.send(('done', None))
+
+
+def run_map(tsize, seed=0, vertices=None, boosters=1.0, program='walker', stop=None, timeout=None, max_rss=None):
+    ctx = multiprocessing.get_context('spawn')
+    rx, tx = ctx.Pipe(duplex=False)
+    p = ctx.Process(target=run_stages, args=(tsize, seed, vertices, boosters, program, stop, max_rss, tx))
+    p.start()
+    tx.close()
+
+    res = dict(size=tsize, stages=dict(), status='ok')
+    deadline = time.monotonic() + timeout if timeout else None
+    while True:
+        left = None if deadline is None else max(0, deadline - time.monotonic())
+        if not rx.poll(left):
+            res['status'] = 'timeout'
+            break
+        try:
+            kind, x = rx.recv()
+        except EOFError:
+            res['status'] = 'failed'
+            break
+        if kind == 'done':
+            break
+        elif kind == 'failed':
+            res.update(status='failed', **x)
+            break
+        elif kind == 'meta':
+            res.update(x)
+        else:
+            res['stages'][kind] = x
+
+    p.join(1)
+    if p.is_alive():
+        p.terminate()
+        p.join()
+    return res
+
+
+def save_csv(results, fn):
+    fields = ['size', 'cells', 'vertices', 'boosters', 'stage', 'time', 'rss', 'rss_growth', 'status']
+    with open(fn, 'w', newline='') as f:
+        w = csv.writer(f)
+        w.writerow(fields + ['nodes', 'peak_alloc'])
+        for res in results:
+            for stage in STAGES:
+                x = res['stages'].get(stage)
+                if x:
+                    status = 'ok'
+                elif res['status'] != 'ok':
+                    # the stage that was running when the map gave up
+                    x, status = dict(), res['status']
+                else:
+                    continue
+                row = dict(res, stage=stage, status=status, **x)
+                extra = [res.get('nodes', ''), res.get('peak_alloc', '')] if stage == 'solve' else ['', '']
+                w.writerow([row.get(k, '') for k in fields] + extra)
+                if status != 'ok':
+                    break
+
+
+def log_ticks(lo, hi):
+    res = list()
+    for e in range(math.floor(math.log10(lo)), math.ceil(math.log10(hi)) + 1):
+        for m in (1, 2, 5):
+            v = m * 10 ** e
+            if lo <= v <= hi:
+                res.append(v)
+    return res
+
+
+def svg_panel(series, title, unit, x0, width, height):
+    # log-log axes, one polyline per stage
+    pts = [p for xs in series.values() for p in xs]
+    if not pts:
+        return [f'<text x="{x0 + width / 2}" y="{height / 2}" text-anchor="middle">{title}: no data</text>']
+    xlo, xhi = min(p[0] for p in pts), max(p[0] for p in pts)
+    ylo, yhi = min(p[1] for p in pts), max(p[1] for p in pts)
+    xlo, xhi = xlo / 1.2, xhi * 1.2
+    ylo, yhi = ylo / 2, yhi * 2
+    left, right, top, bottom = x0 + 60, x0 + width - 20, 40, height - 50
+
+    def sx(v):
+        return left + (right - left) * (math.log10(v) - math.log10(xlo)) / (math.log10(xhi) - math.log10(xlo))
+
+    def sy(v):
+        return bottom - (bottom - top) * (math.log10(v) - math.log10(ylo)) / (math.log10(yhi) - math.log10(ylo))
+
+    out = [
+        f'<text x="{(left + right) / 2}" y="24" text-anchor="middle" font-weight="bold">{title}</text>',
+        f'<rect x="{left}" y="{top}" width="{right - left}" height="{bottom - top}" fill="none" stroke="#888"/>',
+        f'<text x="{(left + right) / 2}" y="{height - 12}" text-anchor="middle">cells per side</text>',
+    ]
+    for v in log_ticks(xlo, xhi):
+        out.append(f'<line x1="{sx(v):.1f}" y1="{top}" x2="{sx(v):.1f}" y2="{bottom}" stroke="#eee"/>')
+        out.append(f'<text x="{sx(v):.1f}" y="{bottom + 16}" text-anchor="middle">{v:g}</text>')
+    for v in log_ticks(ylo, yhi):
+        out.append(f'<line x1="{left}" y1="{sy(v):.1f}" x2="{right}" y2="{sy(v):.1f}" stroke="#eee"/>')
+        out.append(f'<text x="{left - 6}" y="{sy(v) + 4:.1f}" text-anchor="end">{v:g}{unit}</text>')
+    for i, (stage, xs) in enumerate(series.items()):
+        if not xs: continue
+        color = _colors[i % len(_colors)]
+        line = ' '.join(f'{sx(x):.1f},{sy(y):.1f}' for x, y in xs)
+        out.append(f'<polyline points="{line}" fill="none" stroke="{color}" stroke-width="2"/>')
+        for x, y in xs:
+            out.append(f'<circle cx="{sx(x):.1f}" cy="{sy(y):.1f}" r="3" fill="{color}"/>')
+    return out
+
+
+def save_svg(results, fn, title=''):
+    times = {s: [(r['size'], r['stages'][s]['time']) for r in results if s in r['stages']] for s in STAGES}
+    # stages that grew the peak by less than this are left off the log scale
+    mem = {s: [(r['size'], r['stages'][s]['rss_growth'] / 2**20) for r in results
+        if s in r['stages'] and r['stages'][s]['rss_growth'] >= 2**18] for s in STAGES}
+    times = {s: [(x, max(y, 1e-6)) for x, y in xs] for s, xs in times.items()}
+    width, height = 520, 400
+    out = [
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{2 * width}" height="{height + 40}" '
+        f'font-family="sans-serif" font-size="11">',
+        '<rect width="100%" height="100%" fill="white"/>',
+    ]
+    out += svg_panel(times, f'time {title}', 's', 0, width, height)
+    out += svg_panel(mem, f'peak RSS growth {title}', 'M', width, width, height)
+    x = 60
+    for i, stage in enumerate(STAGES):
+        color = _colors[i % len(_colors)]
+        out.append(f'<rect x="{x}" y="{height + 14}" width="12" height="12" fill="{color}"/>')
+        out.append(f'<text x="{x + 16}" y="{height + 24}">{stage}</text>')
+        x += 24 + 7 * len(stage)
+    out.append('</svg>')
+    with open(fn, 'w') as f:
+        f.write('\n'.join(out) + '\n')
+
+
+def report(results):
+    trace(f'{"size":>6}{"cells":>10}' + ''.join(f'{s:>10}' for s in STAGES) + f'{"rss MB":>10}  status')
+    for res in results:
+        st = res['stages']
+        ms = ''.join(f'{st[s]["time"] * 1000:10.1f}' if s in st else f'{"-":>10}' for s in STAGES)
+        rss = max((x['rss'] for x in st.values()), default=0) / 2**20
+        trace(f'{res["size"]:6}{res.get("cells", "-"):>10}' + ms + f'{rss:10.1f}  {res["status"]}' + (f', {res["error"]}' if 'error' in res else ''))
+
+
+def run(outdir=None, sizes=SIZES, seed=0, vertices=None, boosters=1.0, program='walker', stop=None, timeout=None,
+        max_rss=None):
+    outdir = outdir or _scaling_dir
+    os.makedirs(outdir, exist_ok=True)
+    results = list()
+    for tsize in sizes:
+        trace(map_name(tsize, seed))
+        res = run_map(tsize, seed=seed, vertices=vertices, boosters=boosters, program=program, stop=stop,
+            timeout=timeout, max_rss=max_rss)
+        results.append(res)
+
+    report(results)
+    fn = os.path.join(outdir, f'scaling-{program}-{seed}')
+    save_csv(results, fn + '.csv')
+    save_svg(results, fn + '.svg', title=f'({program}, seed {seed})')
+    trace(fn + '.csv')
+    trace(fn + '.svg')
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser()
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    def family_args(p):
+        p.add_argument('-s', '--sizes', type=lambda s: [int(x) for x in s.split(',')], default=SIZES,
+            help='Cells per side, comma separated')
+        p.add_argument('--seed', type=int, default=0, help='Family seed')
+        p.add_argument('-V', '--vertices', type=int, help='Rough target for outline vertices, default one per cell of side; '
+            'the digger only gets near it, e.g. 48, 110 and 184 for 50, 100 and 200')
+        p.add_argument('-B', '--boosters', type=float, default=1.0, help='Boosters per thousand cells')
+        p.add_argument('-o', '--outdir', metavar='DIR', help='Output directory, default data/scaling')
+
+    p = sub.add_parser('gen', help='Write the map family as .desc files, with the .cond each was dug from')
+    family_args(p)
+
+    p = sub.add_parser('run', help='Time every pipeline stage on the map family, save CSV and SVG plots')
+    family_args(p)
+    p.add_argument('-n', '--program', default='walker', help='Solver program')
+    p.add_argument('--stop', choices=STAGES, help='Last stage to run')
+    p.add_argument('-t', '--timeout', type=float, default=600, help='Timeout per map')
+    p.add_argument('-m', '--max-rss', type=int, metavar='MB', help='Address space limit per map')
+
+    args = parser.parse_args()
+
+    if args.command == 'gen':
+        gen(args.outdir, sizes=args.sizes, seed=args.seed, vertices=args.vertices, boosters=args.boosters)
+    else:
+        run(args.outdir, sizes=args.sizes, seed=args.seed, vertices=args.vertices, boosters=args.boosters,
+            program=args.program, stop=args.stop, timeout=args.timeout,
+            max_rss=args.max_rss * 2**20 if args.max_rss else None)
@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+import json
+import math
+import os
+import sys
+import threading
+import time
+from functools import lru_cache
+
+import numpy as np
+
+import simulator
+import solver
+
+
+def trace(*args, **kwargs):
+    print(*args, file=sys.stderr, flush=True, **kwargs)
+
+
+_history_var = 'ICFPC_HISTORY'
+_history_file = os.path.join(os.path.dirname(__file__), '../data/history.jsonl')
+# past this size the file is cut down to its newer half
+_history_limit = 8 * 2**20
+
+PROGRAMS = ['walker', 'greedy', 'pywalker']
+
+
+def features(board, grid):
+    # cheap shape and booster descriptors, each roughly in 0..1
+    free = simulator.grid_mask(grid, board.size)
+    area = board.size[0] * board.size[1]
+    cells = int(free.sum())
+    nb = np.zeros(free.shape, dtype=np.int8)
+    nb[1:, :] += free[:-1, :]
+    nb[:-1, :] += free[1:, :]
+    nb[:, 1:] += free[:, :-1]
+    nb[:, :-1] += free[:, 1:]
+    corridor = int((free & (nb <= 2)).sum())
+    counts = {t: 0 for t in 'BFLRCX'}
+    for t, _ in board.boosters:
+        counts[t] = counts.get(t, 0) + 1
+    per = 1000 / max(1, cells)
+    return dict(
+        size=math.log10(max(1, area)) / 6,
+        fill=cells / max(1, area),
+        corridor=corridor / max(1, cells),
+        obstacles=min(1, len(board.obstacles) / 100),
+        manipulators=min(1, counts['B'] * per / 10),
+        speed=min(1, (counts['F'] + counts['L']) * per / 10),
+        teleports=min(1, counts['R'] * per / 10),
+        clones=min(1, (counts['C'] + counts['X']) * per),
+    )
+
+
+def distance(a, b):
+    return math.sqrt(sum((a[k] - b.get(k, 0)) ** 2 for k in a))
+
+
+def steps(ans):
+    return max(len(x) for x in simulator.parse_solution(ans))
+
+
+class History:
+    # the file is only appended to: a reload reads what other processes added since the last one,
+    # what this one adds is kept as it is written
+    def __init__(self, path=None, limit=_history_limit):
+        self.path = path or os.environ.get(_history_var) or _history_file
+        self.limit = limit
+        self.records = list()
+        self.inode = None
+        self.offset = 0
+        self.lock = threading.Lock()
+
+    def load(self):
+        with self.lock:
+            try:
+                st = os.stat(self.path)
+            except OSError:
+                return self.records
+            if st.st_ino != self.inode or st.st_size < self.offset:
+                # new, replaced or cut down: read it all
+                self.inode = st.st_ino
+                self.offset = 0
+                self.records = list()
+            if st.st_size > self.offset:
+                with open(self.path, 'rb') as f:
+                    f.seek(self.offset)
+                    data = f.read()
+                # a line still being written is left for the next time
+                data = data[:data.rfind(b'\n') + 1]
+                self.offset += len(data)
+                self.records += [json.loads(x) for x in data.splitlines() if x.strip()]
+            return self.records
+
+    def add(self, feats, program, cells, ans, seconds):
+        rec = dict(ts=time.time(), program=program, features=feats, cells=cells, steps=steps(ans), seconds=seconds)
+        line = (json.dumps(rec) + '\n').encode()
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with self.lock:
+            with open(self.path, 'ab') as f:
+                f.write(line)
+                end = f.tell()
+                inode = os.fstat(f.fileno()).st_ino
+            if inode == self.inode and end - len(line) == self.offset:
+                # nobody wrote in between, no need to read it back
+                self.offset = end
+                self.records.append(rec)
+            if end > self.limit:
+                self.rotate()
+
+    def rotate(self):
+        with open(self.path, 'rb') as f:
+            lines = f.readlines()
+        tmp = self.path + f'.{os.getpid()}.{threading.get_ident()}'
+        with open(tmp, 'wb') as f:
+            f.writelines(lines[len(lines) // 2:])
+        os.replace(tmp, self.path)
+
+
+@lru_cache(maxsize=None)
+def shared_history(path):
+    return History(path)
+
+
+def open_history(history):
+    # one per process, records are kept across the jobs it solves
+    if history is True:
+        return shared_history(os.environ.get(_history_var) or _history_file)
+    return history or None
+
+
+class Selector:
+    # predicts steps and seconds per free cell of each program from its k nearest recorded maps
+    def __init__(self, history=None, programs=None, k=8, radius=0.3, min_samples=3, tolerance=0.02, spread=0.1):
+        self.history = open_history(history if history is not None else True) or History()
+        self.programs = programs or self.available()
+        self.k = k
+        self.radius = radius
+        self.min_samples = min_samples
+        self.tolerance = tolerance
+        self.spread = spread
+
+    def available(self):
+        return [p for p in PROGRAMS if p == 'pywalker' or os.path.isfile(solver.lib_path(p))]
+
+    def predict(self, feats, program):
+        xs = [(distance(feats, r['features']), r) for r in self.history.load() if r['program'] == program]
+        xs = sorted(xs, key=lambda x: x[0])[:self.k]
+        if sum(1 for d, _ in xs if d <= self.radius) < self.min_samples:
+            return None
+        ws = [1 / (d + 0.01) for d, _ in xs]
+        total = sum(ws)
+        return dict(
+            steps=sum(w * r['steps'] / max(1, r['cells']) for w, (_, r) in zip(ws, xs)) / total,
+            seconds=sum(w * r['seconds'] / max(1, r['cells']) for w, (_, r) in zip(ws, xs)) / total,
+            samples=len(xs),
+        )
+
+    def choose(self, feats, portfolio=2):
+        preds = {p: self.predict(feats, p) for p in self.programs}
+        known = sorted((p for p in self.programs if preds[p]), key=lambda p: preds[p]['steps'])
+        unknown = [p for p in self.programs if not preds[p]]
+        res = list()
+        if known:
+            # within tolerance of the best score, take the fastest
+            best = preds[known[0]]['steps']
+            close = [p for p in known if preds[p]['steps'] <= best * (1 + self.tolerance)]
+            res.append(min(close, key=lambda p: preds[p]['seconds']))
+            # too close to call, or never tried on maps like this one: run them too, and learn
+            res += [p for p in known if p not in res and preds[p]['steps'] <= best * (1 + self.spread)]
+        res += unknown
+        return res[:max(1, portfolio)], preds
+
+
+def main(infile, portfolio=2):
+    with open(infile) as f:
+        board = solver.Board.load(f)
+    feats = features(board, board.gen_grid())
+    sel = Selector()
+    choice, preds = sel.choose(feats, portfolio=portfolio)
+    trace(' '.join(f'{k} {v:.3f}' for k, v in feats.items()))
+    for p in sel.programs:
+        x = preds[p]
+        trace(f'{p:10}' + (f'{x["steps"]:8.3f} steps/cell {x["seconds"] * 1000:8.3f} ms/cell, {x["samples"]} samples' if x else '  no data'))
+    print(' '.join(choice))
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-k', '--portfolio', type=int, default=2, help='Most programs to run')
+    parser.add_argument('infile', help='Problem description')
+    args = parser.parse_args()
+
+    main(args.infile, portfolio=args.portfolio)
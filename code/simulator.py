@@ -0,0 +1,290 @@
+#!/usr/bin/env python
+import re
+import sys
+from fractions import Fraction
+from functools import lru_cache
+
+import numpy as np
+
+
+def trace(*args, **kwargs):
+    print(*args, file=sys.stderr, flush=True, **kwargs)
+
+
+class SimulationError(Exception): pass
+
+
+actions_rx = re.compile(r'[WSADZEQFLRC]|[BT]\((-?\d+),(-?\d+)\)')
+
+def parse_actions(s):
+    res = list()
+    pos = 0
+    for m in actions_rx.finditer(s):
+        if m.start() != pos:
+            raise SimulationError(f'bad action at {pos}: {s[pos:pos+10]!r}')
+        pos = m.end()
+        a = m.group(0)[0]
+        if m.group(1) is None:
+            res.append((a,))
+        else:
+            res.append((a, int(m.group(1)), int(m.group(2))))
+    if pos != len(s):
+        raise SimulationError(f'bad action at {pos}: {s[pos:pos+10]!r}')
+    return res
+
+
+def parse_solution(s):
+    return [parse_actions(x) for x in re.sub(r'\s', '', s).split('#')]
+
+
+def dump_action(a):
+    if len(a) == 1:
+        return a[0]
+    return f'{a[0]}({a[1]},{a[2]})'
+
+
+def dump_solution(routes):
+    return '#'.join(''.join(dump_action(a) for a in route) for route in routes)
+
+
+def grid_mask(grid, size):
+    w, h = size
+    mask = np.zeros((h, w), dtype=bool)
+    if grid:
+        xs, ys = np.array(list(grid)).T
+        mask[ys, xs] = True
+    return mask
+
+
+@lru_cache(maxsize=None)
+def sightline(dx, dy):
+    # cells whose interior is crossed by the segment between cell centers
+    def span(p, d, i):
+        if d == 0:
+            return (Fraction(0), Fraction(1)) if i < p < i + 1 else None
+        a, b = Fraction(i - p, d), Fraction(i + 1 - p, d)
+        return (min(a, b), max(a, b))
+
+    res = list()
+    for x in range(min(0, dx), max(0, dx) + 1):
+        for y in range(min(0, dy), max(0, dy) + 1):
+            if (x, y) in ((0, 0), (dx, dy)): continue
+            sx = span(Fraction(1, 2), dx, x)
+            sy = span(Fraction(1, 2), dy, y)
+            if sx is None or sy is None: continue
+            lo = max(sx[0], sy[0], 0)
+            hi = min(sx[1], sy[1], 1)
+            if lo < hi:
+                res.append((x, y))
+    return tuple(res)
+
+
+moves = {
+    'W': (0, 1),
+    'S': (0, -1),
+    'A': (-1, 0),
+    'D': (1, 0),
+}
+
+
+class Bot:
+    def __init__(self, pos, route):
+        self.pos = pos
+        self.manips = [(1, 0), (1, 1), (1, -1)]
+        self.route = route
+        self.cursor = 0
+        self.wheels = 0
+        self.drill = 0
+
+    @property
+    def done(self):
+        return self.cursor >= len(self.route)
+
+
+class Simulator:
+    def __init__(self, free, pos, boosters):
+        self.free = np.array(free, dtype=bool)
+        self.size = (self.free.shape[1], self.free.shape[0])
+        self.wrapped = np.zeros_like(self.free)
+        self.boosters = dict()
+        self.spawns = set()
+        for t, p in boosters:
+            if t == 'X':
+                self.spawns.add(tuple(p))
+            else:
+                self.boosters[tuple(p)] = t
+        self.start = tuple(pos)
+        self.beacons = set()
+        self.bag = list()
+        self.routes = list()
+        self.bots = list()
+        self.time = 0
+        self.changed = set()
+        self.observer = None
+
+    def is_free(self, p):
+        x, y = p
+        w, h = self.size
+        return 0 <= x < w and 0 <= y < h and self.free[y, x]
+
+    def reach(self, bot):
+        bx, by = bot.pos
+        res = [bot.pos]
+        for dx, dy in bot.manips:
+            if not self.is_free((bx + dx, by + dy)): continue
+            if all(self.is_free((bx + x, by + y)) for x, y in sightline(dx, dy)):
+                res.append((bx + dx, by + dy))
+        return res
+
+    def wrap(self, i, bot):
+        cells = self.reach(bot)
+        for x, y in cells:
+            if not self.wrapped[y, x]:
+                self.wrapped[y, x] = True
+                self.changed.add((x, y))
+        if self.observer:
+            self.observer(i, bot, cells)
+
+    def load(self, solution):
+        if isinstance(solution, str):
+            solution = parse_solution(solution)
+        self.routes = solution
+        bot = Bot(self.start, self.routes[0])
+        self.bots = [bot]
+        self.pick(0, bot)
+        self.wrap(0, bot)
+
+    def take(self, i, t):
+        for n, (bt, at, owner) in enumerate(self.bag):
+            if bt != t: continue
+            if self.time < at + (1 if i >= owner else 2): continue
+            del self.bag[n]
+            return True
+        raise SimulationError(f'bot {i}: no {t} booster at time {self.time}')
+
+    def pick(self, i, bot):
+        t = self.boosters.pop(bot.pos, None)
+        if t:
+            self.bag.append((t, self.time, i))
+            self.changed.add(bot.pos)
+
+    def move(self, i, bot, d, drill):
+        x, y = bot.pos
+        p = (x + d[0], y + d[1])
+        w, h = self.size
+        if not (0 <= p[0] < w and 0 <= p[1] < h):
+            return False
+        if not self.free[p[1], p[0]]:
+            if not drill:
+                return False
+            self.free[p[1], p[0]] = True
+            self.changed.add(p)
+        bot.pos = p
+        self.pick(i, bot)
+        self.wrap(i, bot)
+        return True
+
+    def act(self, i, bot, action):
+        a = action[0]
+        wheels = bot.wheels > 0
+        drill = bot.drill > 0
+        bot.wheels = max(0, bot.wheels - 1)
+        bot.drill = max(0, bot.drill - 1)
+
+        if a in moves:
+            d = moves[a]
+            if not self.move(i, bot, d, drill):
+                raise SimulationError(f'bot {i}: blocked {a} at {bot.pos}, time {self.time}')
+            if wheels:
+                self.move(i, bot, d, drill)
+        elif a == 'Z':
+            pass
+        elif a == 'E':
+            bot.manips = [(dy, -dx) for dx, dy in bot.manips]
+            self.wrap(i, bot)
+        elif a == 'Q':
+            bot.manips = [(-dy, dx) for dx, dy in bot.manips]
+            self.wrap(i, bot)
+        elif a == 'B':
+            self.take(i, 'B')
+            p = action[1:]
+            near = [(0, 0)] + bot.manips
+            if p in near or not any(abs(p[0] - x) + abs(p[1] - y) == 1 for x, y in near):
+                raise SimulationError(f'bot {i}: cannot attach {p} at time {self.time}')
+            bot.manips.append(p)
+            self.wrap(i, bot)
+        elif a == 'F':
+            self.take(i, 'F')
+            bot.wheels = 50
+        elif a == 'L':
+            self.take(i, 'L')
+            bot.drill = 30
+        elif a == 'R':
+            if bot.pos in self.beacons or bot.pos in self.spawns:
+                raise SimulationError(f'bot {i}: cannot install beacon at {bot.pos}')
+            self.take(i, 'R')
+            self.beacons.add(bot.pos)
+        elif a == 'T':
+            p = action[1:]
+            if p not in self.beacons:
+                raise SimulationError(f'bot {i}: no beacon at {p}')
+            bot.pos = p
+            self.pick(i, bot)
+            self.wrap(i, bot)
+        elif a == 'C':
+            if bot.pos not in self.spawns:
+                raise SimulationError(f'bot {i}: not on a spawn point at {bot.pos}')
+            self.take(i, 'C')
+            n = len(self.bots)
+            route = self.routes[n] if n < len(self.routes) else []
+            clone = Bot(bot.pos, route)
+            self.bots.append(clone)
+            self.wrap(n, clone)
+        else:
+            raise SimulationError(f'bot {i}: unknown action {a}')
+
+    def step(self):
+        for i, bot in enumerate(list(self.bots)):
+            if bot.done: continue
+            t = self.boosters.pop(bot.pos, None)
+            if t:
+                # collected in the turn it was stepped into
+                self.bag.append((t, self.time - 1, i))
+                self.changed.add(bot.pos)
+            action = bot.route[bot.cursor]
+            bot.cursor += 1
+            self.act(i, bot, action)
+        self.time += 1
+
+    @property
+    def running(self):
+        return any(not bot.done for bot in self.bots)
+
+    def replay(self):
+        while self.running:
+            self.step()
+            yield self.time
+
+    def run(self):
+        for _ in self.replay():
+            pass
+        return self.time
+
+    def complete(self):
+        return not np.any(self.free & ~self.wrapped)
+
+    def flush(self):
+        res = self.changed
+        self.changed = set()
+        return res
+
+
+def score(free, pos, boosters, solution):
+    sim = Simulator(free, pos, boosters)
+    try:
+        sim.load(solution)
+        t = sim.run()
+    except SimulationError as e:
+        trace(e)
+        return None
+    return t if sim.complete() else None
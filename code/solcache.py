@@ -0,0 +1,125 @@
+import hashlib
+import os
+import random
+import threading
+from functools import lru_cache
+
+import solver
+
+
+_cache_var = 'ICFPC_CACHE'
+_cache_dir = os.path.join(os.path.dirname(__file__), '../data/cache')
+# share of writes that walk the tree for what other processes wrote
+_evict_rate = 1 / 64
+# eviction goes this far below the limit so the next writes do not walk again
+_low_water = 0.9
+
+_hashes = dict()
+
+
+def file_hash(fn):
+    # remembered until the file changes
+    st = os.stat(fn)
+    stamp = (st.st_mtime_ns, st.st_size)
+    x = _hashes.get(fn)
+    if x and x[0] == stamp:
+        return x[1]
+    with open(fn, 'rb') as f:
+        h = hashlib.sha256(f.read()).hexdigest()
+    _hashes[fn] = (stamp, h)
+    return h
+
+
+def program_version(program, optimize=True):
+    here = os.path.dirname(__file__)
+    fns = [solver.lib_path(program)]
+    if program == 'pywalker' or not os.path.isfile(fns[0]):
+        fns = [os.path.join(here, 'pywalker.py')]
+    if optimize:
+        fns.append(os.path.join(here, 'peephole.py'))
+    h = hashlib.sha256(program.encode())
+    for fn in fns:
+        h.update(file_hash(fn).encode())
+    return h.hexdigest()[:16]
+
+
+class Cache:
+    def __init__(self, path=None, limit=256 * 2**20):
+        self.path = path or os.environ.get(_cache_var) or _cache_dir
+        self.limit = limit
+        # bytes written since the last walk counted on top of what it found, unknown before the first one
+        self.total = None
+        self.lock = threading.Lock()
+
+    def key(self, desc, program, optimize=True):
+        # the problem text as it is, a hit needs no parsing
+        h = hashlib.sha256(desc.encode()).hexdigest()
+        return hashlib.sha256(f'{h}:{program_version(program, optimize)}'.encode()).hexdigest()
+
+    def filename(self, key):
+        return os.path.join(self.path, key[:2], key + '.sol')
+
+    def get(self, key):
+        fn = self.filename(key)
+        try:
+            with open(fn) as f:
+                ans = f.read()
+        except OSError:
+            return None
+        os.utime(fn)
+        return ans
+
+    def put(self, key, ans):
+        fn = self.filename(key)
+        os.makedirs(os.path.dirname(fn), exist_ok=True)
+        # one temp file per writer, solver threads of a process included
+        tmp = fn + f'.{os.getpid()}.{threading.get_ident()}'
+        with open(tmp, 'w') as f:
+            f.write(ans)
+        os.replace(tmp, fn)
+        with self.lock:
+            if self.total is not None:
+                self.total += len(ans)
+            due = (self.total or 0) > self.limit or random.random() < _evict_rate
+        if due:
+            self.evict()
+
+    def entries(self):
+        res = list()
+        for root, _, names in os.walk(self.path):
+            for name in names:
+                if not name.endswith('.sol'): continue
+                fn = os.path.join(root, name)
+                try:
+                    st = os.stat(fn)
+                except OSError:
+                    continue
+                res.append((st.st_mtime, st.st_size, fn))
+        return res
+
+    def evict(self):
+        # least recently used first, until the cache fits
+        entries = sorted(self.entries())
+        total = sum(x[1] for x in entries)
+        if total > self.limit:
+            for _, size, fn in entries:
+                if total <= self.limit * _low_water: break
+                try:
+                    os.remove(fn)
+                except OSError:
+                    pass
+                total -= size
+        with self.lock:
+            self.total = total
+
+
+@lru_cache(maxsize=None)
+def shared_cache(path):
+    return Cache(path)
+
+
+def open_cache(cache):
+    # one per process, the running size is kept across the jobs it solves
+    if cache is True:
+        return shared_cache(os.environ.get(_cache_var) or _cache_dir)
+    return cache or None
@@ -1,14 +1,28 @@
 #!/usr/bin/env python
 import ctypes
+import json
 import os
 import re
+import resource
 import sys
+import time
 from collections import namedtuple
+from contextlib import contextmanager, nullcontext
+from functools import lru_cache
+
+# peephole, selector and solcache import solver back; they only use it inside functions, so the cycle resolves
+import peephole
+import pywalker
+import selector
+import simulator
+import solcache
 
 
 class Board:
     def load(f):
-        desc = f.read()
+        return Board.loads(f.read())
+
+    def loads(desc):
         mine, pos, obstacles, boosters = desc.split('#')
         mine = parse_points(mine)
         pos, = parse_points(pos)
@@ -61,7 +75,7 @@ def parse_points(s):
     return [tuple(map(int, p)) for p in points_rx.findall(s)]
 
 
-State = namedtuple('State', 'mine_size, pos, rotation, grid, boosters')
+State = namedtuple('State', 'mine_size, pos, rotation, grid, boosters, bound', defaults=(None,))
 
 
 class CBooster(ctypes.Structure):
@@ -71,6 +85,30 @@ class CBooster(ctypes.Structure):
         ('type', ctypes.c_char),
     ]
 
+PHASES = ['setup', 'closest', 'path', 'apply']
+BOOSTERS = 'BFLRCX'
+
+
+class CStats(ctypes.Structure):
+    _fields_ = [
+        ('nodes', ctypes.c_ulonglong),
+        ('bfs_calls', ctypes.c_ulonglong),
+        ('path_calls', ctypes.c_ulonglong),
+        ('peak_alloc', ctypes.c_ulonglong),
+        ('phase_time', ctypes.c_double * len(PHASES)),
+        ('boosters_used', ctypes.c_uint * len(BOOSTERS)),
+    ]
+
+    def to_dict(self):
+        return dict(
+            nodes=self.nodes,
+            bfs_calls=self.bfs_calls,
+            path_calls=self.path_calls,
+            peak_alloc=self.peak_alloc,
+            phases=dict(zip(PHASES, self.phase_time)),
+            boosters={t: n for t, n in zip(BOOSTERS, self.boosters_used) if n},
+        )
+
 class CProblem(ctypes.Structure):
     _fields_ = [
         ('posx', ctypes.c_ushort),
@@ -80,16 +118,34 @@ class CProblem(ctypes.Structure):
         ('grid', ctypes.POINTER(ctypes.c_ushort)),
         ('booster_size', ctypes.c_uint),
         ('boosters', ctypes.POINTER(CBooster)),
+        ('bound', ctypes.c_uint),
+        ('stats', ctypes.POINTER(CStats)),
     ]
 
 
-class Solver:
-    def __init__(self, name='walker'):
-        libname = f'{name}/build/release/lib{name}.dylib'
-        libname = os.path.join(os.path.dirname(__file__), libname)
-        self.bot = ctypes.cdll.LoadLibrary(libname)
+_lib_suffix = {'darwin': '.dylib', 'win32': '.dll'}.get(sys.platform, '.so')
 
-    def solve(self, state):
+
+def lib_path(name):
+    libname = f'{name}/build/release/lib{name}{_lib_suffix}'
+    return os.path.join(os.path.dirname(__file__), libname)
+
+
+@lru_cache(maxsize=None)
+def load_lib(name):
+    # one handle per library, shared by every solver thread of the process
+    return ctypes.cdll.LoadLibrary(lib_path(name))
+
+
+class Solver:
+    def __init__(self, name='walker', stats=False):
+        self.bot = load_lib(name)
+        self.bounded = False
+        # filled in by the library on every run when asked for, None otherwise
+        self.cstats = CStats() if stats else None
+        self.stats = None
+
+    def encode(self, state):
         grid_t = ctypes.c_ushort * (2 * len(state.grid))
         grid = grid_t(*(x for p in state.grid for x in p))
         boost_t = CBooster * len(state.boosters)
@@ -97,7 +153,7 @@ class Solver:
             CBooster(posx=x[1][0], posy=x[1][1], type=ord(x[0]))
             for x in state.boosters))
 
-        cx = CProblem(
+        return CProblem(
             posx=state.pos[0],
             posy=state.pos[1],
             rotation=state.rotation,
@@ -105,56 +161,257 @@ class Solver:
             grid=ctypes.cast(grid, ctypes.POINTER(ctypes.c_ushort)),
             booster_size=len(boosters),
             boosters=ctypes.cast(boosters, ctypes.POINTER(CBooster)),
+            bound=state.bound or 0,
+            stats=ctypes.pointer(self.cstats) if self.cstats is not None else None,
             )
 
-        ans_len = state.mine_size[0] * state.mine_size[1] * 2
+    def run(self, cx, ans_len):
         ans = (ctypes.c_char * ans_len)()
         r = self.bot.solve(ctypes.byref(cx), ans_len, ctypes.byref(ans))
+        self.bounded = r == 2
+        if self.cstats is not None:
+            self.stats = self.cstats.to_dict()
         if r != 0:
-            print('err', r, file=sys.stderr)
+            if not self.bounded:
+                print('err', r, file=sys.stderr)
             return
         ans = ctypes.cast(ans, ctypes.c_char_p)
         return ans.value.decode('utf8')
 
+    def solve(self, state):
+        cx = self.encode(state)
+        ans_len = state.mine_size[0] * state.mine_size[1] * 2
+        return self.run(cx, ans_len)
+
+
+def open_solver(name='walker', stats=False):
+    if name == 'pywalker':
+        return pywalker.Solver(stats=stats)
+    try:
+        return Solver(name=name, stats=stats)
+    except OSError as e:
+        print(f'{e}, falling back to pywalker', file=sys.stderr)
+        return pywalker.Solver(stats=stats)
+
+
+_trace_var = 'ICFPC_TRACE'
+
+
+# high-water mark of the whole process, it never goes down: in a long lived worker
+# only the growth over a stage or a job says something about that stage or job
+def peak_rss():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+class NullTracer:
+    _stage = nullcontext()
+
+    def begin(self, problem, program):
+        return self
+
+    def stage(self, name):
+        return self._stage
+
+    def end(self, **kwargs):
+        pass
+
+
+class Tracer:
+    def __init__(self, fn):
+        self.fn = fn
+        self.record = None
+
+    def begin(self, problem, program):
+        self.record = dict(ts=time.time(), pid=os.getpid(), problem=problem, program=program, stages=dict())
+        self.rss = peak_rss()
+        return self
+
+    @contextmanager
+    def stage(self, name):
+        rss = peak_rss()
+        t = time.perf_counter()
+        try:
+            yield
+        finally:
+            t = time.perf_counter() - t
+            x = peak_rss()
+            if self.record:
+                self.record['stages'][name] = dict(time=t, rss=x, rss_growth=x - rss)
+
+    def end(self, **kwargs):
+        # a timed out job is closed by the caller, the abandoned solve must not write again
+        if not self.record: return
+        self.record.update(kwargs, rss_growth=peak_rss() - self.rss)
+        with open(self.fn, 'a') as f:
+            f.write(json.dumps(self.record) + '\n')
+        self.record = None
+
+
+def tracer(fn=None):
+    fn = fn or os.environ.get(_trace_var)
+    return Tracer(fn) if fn else NullTracer()
+
+
+def better(a, b, score):
+    # by simulated time, a solution the simulator rejects loses, by length when it rejects both
+    x, y = score(a), score(b)
+    if x is None and y is None:
+        return len(a) < len(b)
+    return y is None or (x is not None and x < y)
+
 
 class Worker:
-    def __init__(self, program=None):
+    def __init__(self, program=None, trace=None, optimize=True, warm=True, cache=True, history=None, portfolio=2):
         self.program = program
+        self.tracer = tracer(trace)
+        self.optimize = optimize
+        self.warm = warm
+        self.cache = solcache.open_cache(cache)
+        # results feed auto selection, other runs record them only when asked to
+        self.history = selector.open_history(program == 'auto' if history is None else history)
+        self.portfolio = portfolio
+        self.status = None
+        self.length = None
+        self.chosen = None
+        self.stats = None
+        self.runs = dict()
+
+    def select(self, parse, tr):
+        feats = None
+        if self.history or self.program == 'auto':
+            board, grid = parse()
+            with tr.stage('features'):
+                feats = selector.features(board, grid)
+        if self.program != 'auto':
+            return [self.program], feats, set()
+        with tr.stage('select'):
+            programs, preds = selector.Selector(self.history or None).choose(feats, self.portfolio)
+        return programs, feats, {p for p in programs if not preds[p]}
+
+    def run(self, program, board, grid, bound, feats, stage):
+        state = State(mine_size=board.size, pos=board.pos, rotation=0, grid=grid, boosters=board.boosters, bound=bound)
+        sol = open_solver(program, stats=True)
+        t = time.perf_counter()
+        with stage('encode'):
+            cx = sol.encode(state)
+        with stage('solve'):
+            ans = sol.run(cx, board.size[0] * board.size[1] * 2)
+        self.runs[program] = sol.stats
+        if not ans:
+            return None, sol.bounded
+
+        if self.optimize:
+            with stage('optimize'):
+                ans = peephole.optimize_board(board, grid, ans)
+        if self.history:
+            self.history.add(feats, program, len(grid), ans, time.perf_counter() - t)
+        return ans, False
+
+    def solve(self, infile, outfile=None, parsed=None):
+        name = infile if isinstance(infile, str) else getattr(infile, 'name', None)
+        tr = self.tracer.begin(name, self.program)
+        self.stats = None
+        self.runs = dict()
 
-    def solve(self, infile, outfile=None):
         if isinstance(infile, str):
             with open(infile) as f:
-                board = Board.load(f)
+                desc = f.read()
         else:
-            board = Board.load(infile)
-        grid = board.gen_grid()
-
-        state = State(mine_size=board.size, pos=board.pos, rotation=0, grid=grid, boosters=board.boosters)
-        sol = Solver(name=self.program)
-        ans = sol.solve(state)
-
-        if not ans:
-            return 1
+            desc = infile.read()
+        board, grid = parsed or (None, None)
+
+        def parse():
+            # only when something needs the map, a cache hit may not
+            nonlocal board, grid
+            if grid is None:
+                with tr.stage('load'):
+                    board = Board.loads(desc)
+                with tr.stage('gen_grid'):
+                    grid = board.gen_grid()
+            return board, grid
 
         old = None
         if outfile and os.path.isfile(outfile):
             with open(outfile) as f:
                 old = f.read().strip()
 
-        if old and (len(old) <= len(ans)):
+        programs, feats, explore = self.select(parse, tr)
+        free = None
+        scores = dict()
+
+        def score(ans):
+            # simulated time, None when the simulator rejects the solution
+            nonlocal free
+            if ans not in scores:
+                board, grid = parse()
+                free = simulator.grid_mask(grid, board.size) if free is None else free
+                scores[ans] = simulator.score(free, board.pos, board.boosters, ans)
+            return scores[ans]
+
+        warm = bound = None
+        bounded = False
+        best = None
+        for program in programs:
+            # stages per program when running a portfolio
+            stage = (lambda s, p=program: tr.stage(f'{s}:{p}')) if len(programs) > 1 else tr.stage
+
+            ans = None
+            key = None
+            if self.cache:
+                with stage('cache'):
+                    key = self.cache.key(desc, program, self.optimize)
+                    ans = self.cache.get(key)
+            cached = bool(ans)
+
+            if not cached:
+                parse()
+                if old and self.warm and warm is None:
+                    with tr.stage('warm'):
+                        warm = score(old)
+                    bound = warm if bound is None or (warm is not None and warm < bound) else bound
+                # programs with no record on maps like this one run to the end, to learn how they do
+                ans, x = self.run(program, *parse(), warm if program in explore else bound, feats, stage)
+                bounded |= x
+                if ans and key:
+                    self.cache.put(key, ans)
+
+            if ans and (best is None or better(ans, best[0], score)):
+                best = (ans, cached, program)
+                if program != programs[-1]:
+                    # later programs only need to beat this one
+                    t = score(ans)
+                    bound = t if bound is None or (t is not None and t < bound) else bound
+
+        if not best and bounded and old:
+            self.status, self.length = 'kept', len(old)
+            tr.end(status=self.status, length=self.length, bound=bound, programs=programs, stats=self.runs)
             return 0
 
-        if outfile:
-            with open(outfile, 'w') as f:
-                f.write(ans)
-        else:
-            print(ans)
+        if not best:
+            self.status, self.length = 'failed', None
+            tr.end(status=self.status, programs=programs, stats=self.runs)
+            return 1
 
+        ans, cached, self.chosen = best
+        self.stats = self.runs.get(self.chosen)
+        with tr.stage('write'):
+            keep = old and (old == ans or not better(ans, old, score))
+            if keep:
+                pass
+            elif outfile:
+                with open(outfile, 'w') as f:
+                    f.write(ans)
+            else:
+                print(ans)
+
+        self.status, self.length = 'kept' if keep else 'cached' if cached else 'solved', len(ans)
+        tr.end(status=self.status, length=self.length, program=self.chosen, programs=programs, stats=self.runs)
         return 0
 
 
-def solve(infile, outfile=None, program=None):
-    w = Worker(program)
+def solve(infile, outfile=None, program=None, trace=None, optimize=True, warm=True, cache=True, history=None, portfolio=2):
+    w = Worker(program, trace=trace, optimize=optimize, warm=warm, cache=cache, history=history, portfolio=portfolio)
     r = w.solve(infile, outfile)
     if r: exit(int(r))
 
@@ -162,9 +419,17 @@ def solve(infile, outfile=None, program=None):
 if __name__ == '__main__':
     import argparse
     parser = argparse.ArgumentParser()
-    parser.add_argument('-n', '--program', default='greedy', help='Solver program')
+    parser.add_argument('-n', '--program', default='greedy', help='Solver program, auto to pick one from past results')
+    parser.add_argument('-k', '--portfolio', type=int, default=2, help='Most programs to run with auto')
+    parser.add_argument('--no-history', action='store_true', help='Do not record results for auto selection')
+    parser.add_argument('--record', action='store_true', help='Record results for auto selection from other programs too')
+    parser.add_argument('--trace', metavar='FILE', help=f'Append per-stage timings as JSON lines (or set {_trace_var})')
+    parser.add_argument('--raw', action='store_true', help='Skip the peephole post-optimizer')
+    parser.add_argument('--cold', action='store_true', help='Do not bound the solver by the score of the existing solution')
+    parser.add_argument('--no-cache', action='store_true', help='Always solve, ignore the solution cache')
     parser.add_argument('infile', nargs='?', type=argparse.FileType('r'), default=sys.stdin)
     parser.add_argument('outfile', nargs='?')
     args = parser.parse_args()
 
-    solve(args.infile, outfile=args.outfile, program=args.program)
+    solve(args.infile, outfile=args.outfile, program=args.program, trace=args.trace, optimize=not args.raw, warm=not args.cold,
+        cache=not args.no_cache, history=False if args.no_history else True if args.record else None, portfolio=args.portfolio)
@@ -1,3 +1,4 @@
+#include <chrono>
 #include <csignal>
 #include <cstdint>
 #include <cstdio>
@@ -37,6 +38,23 @@ extern "C" {
         BoosterType type;
     } Booster;
 
+    typedef enum : u32 {
+        PhaseSetup,
+        PhaseClosest,
+        PhasePath,
+        PhaseApply,
+        PhaseCount,
+    } Phase;
+
+    typedef struct {
+        u64 nodes; // cells expanded by every search
+        u64 bfs_calls;
+        u64 path_calls;
+        u64 peak_alloc; // bytes held by search containers, estimated from their sizes
+        double phase_time[PhaseCount]; // seconds, closest includes path
+        u32 boosters_used[6]; // B F L R C X
+    } Stats;
+
     typedef struct {
         u16 posx;
         u16 posy;
@@ -45,6 +63,8 @@ extern "C" {
         u16* grid;
         u32 booster_size;
         Booster* boosters;
+        u32 bound; // score to beat, 0 if none
+        Stats* stats; // filled in if not null
     } Problem;
 
     u32 solve(Problem* problem, u32 ans_size, char* ans);
@@ -56,6 +76,62 @@ extern "C" {
 #define POSY(p) (((p) >> 16) & 0xffff)
 
 
+typedef chrono::steady_clock Clock;
+
+// std::set node: three links, a color and the key
+static const u64 set_node_size = 4 * sizeof(void*) + sizeof(u32);
+
+static double
+seconds_since(Clock::time_point t) {
+    return chrono::duration<double>(Clock::now() - t).count();
+}
+
+static void
+note_alloc(Stats* stats, u64 bytes) {
+    if (stats && bytes > stats->peak_alloc) {
+        stats->peak_alloc = bytes;
+    }
+}
+
+struct PhaseTimer {
+    Stats* stats;
+    Phase phase;
+    Clock::time_point start;
+
+    PhaseTimer(Stats* stats, Phase phase) : stats(stats), phase(phase), start(Clock::now()) {}
+
+    ~PhaseTimer() {
+        if (stats) {
+            stats->phase_time[phase] += seconds_since(start);
+        }
+    }
+};
+
+// whatever the search phases did not take
+struct SolveTimer {
+    Stats* stats;
+    Clock::time_point start;
+
+    SolveTimer(Stats* stats) : stats(stats), start(Clock::now()) {}
+
+    ~SolveTimer() {
+        if (stats) {
+            double* t = stats->phase_time;
+            t[PhaseApply] = seconds_since(start) - t[PhaseSetup] - t[PhaseClosest];
+        }
+    }
+};
+
+static void
+note_booster(Stats* stats, BoosterType t) {
+    static const char order[] = "BFLRCX";
+    const char* p = stats ? strchr(order, t) : nullptr;
+    if (p && *p) {
+        stats->boosters_used[p - order] += 1;
+    }
+}
+
+
 static vector<u32>
 move_bot(const vector<u32>& bot, i32 tx, i32 ty) {
     vector<u32> res;
@@ -184,7 +260,12 @@ static Movement rotation_moves[] = {
 
 
 static vector<ActionType>
-find_path(u32 origin, u32 goal, const set<u32>& grid, i32 wheels) {
+find_path(u32 origin, u32 goal, const set<u32>& grid, i32 wheels, Stats* stats, u64 held) {
+    PhaseTimer timer(stats, PhasePath);
+    if (stats) {
+        stats->path_calls++;
+    }
+
     auto comp = [goal, wheels](const find_path_state& a, const find_path_state& b) {
         u32 ma = mdist(a.pos, goal);
         u32 mb = mdist(b.pos, goal);
@@ -223,6 +304,11 @@ find_path(u32 origin, u32 goal, const set<u32>& grid, i32 wheels) {
         }
         visited.emplace(state.pos);
 
+        if (stats) {
+            stats->nodes++;
+            note_alloc(stats, held + visited.size() * set_node_size + fringe.size() * (sizeof(state) + state.path.size()));
+        }
+
         i32 wheels_left = max(0, wheels - i32(state.path.size()));
 
         for (auto mv : valid_moves) {
@@ -259,7 +345,12 @@ typedef struct {
 
 static vector<vector<ActionType>>
 find_closest(u32 origin, set<u32> pending, const set<u32>& grid, const map<u32, BoosterType>& grid_boosters,
-    map<BoosterType, u32> active_boosters) {
+    map<BoosterType, u32> active_boosters, Stats* stats) {
+
+    PhaseTimer timer(stats, PhaseClosest);
+    if (stats) {
+        stats->bfs_calls++;
+    }
 
     for (const auto& p : grid_boosters) {
         BoosterType t = p.second;
@@ -298,6 +389,13 @@ find_closest(u32 origin, set<u32> pending, const set<u32>& grid, const map<u32,
         }
         visited.emplace(pos);
 
+        u64 held = 0;
+        if (stats) {
+            stats->nodes++;
+            held = (pending.size() + visited.size()) * set_node_size + fringe.size() * sizeof(u32);
+            note_alloc(stats, held);
+        }
+
         auto it = pending.find(pos);
         if (it != pending.end()) {
             pending.erase(it);
@@ -317,7 +415,7 @@ find_closest(u32 origin, set<u32> pending, const set<u32>& grid, const map<u32,
 
             u8 has_booster = grid_boosters.find(pos) != grid_boosters.end() ? 1 : 0;
 
-            auto path = find_path(origin, pos, grid, wheels);
+            auto path = find_path(origin, pos, grid, wheels, stats, held);
             if (path.empty()) {
                 continue;
             }
@@ -388,6 +486,12 @@ solve(Problem* problem, u32 ans_size, char* ans) {
 
     ans[0] = 0;
 
+    Stats* stats = problem->stats;
+    if (stats) {
+        memset(stats, 0, sizeof(*stats));
+    }
+    SolveTimer timer(stats);
+
     set<u32> grid;
 
     u16* pgrid = problem->grid;
@@ -442,10 +546,16 @@ solve(Problem* problem, u32 ans_size, char* ans) {
 
     sweep(bot);
 
+    if (stats) {
+        stats->phase_time[PhaseSetup] = seconds_since(timer.start);
+    }
+
     string ans_path;
+    u32 ticks = 0;
 
-    auto tick_with_action = [&active_boosters, &ans_path] (Action action) {
+    auto tick_with_action = [&active_boosters, &ans_path, &ticks] (Action action) {
         ans_path.append(action_str(action));
+        ticks++;
 
         for (const auto& it : active_boosters) {
             if (it.second > 0) {
@@ -454,9 +564,25 @@ solve(Problem* problem, u32 ans_size, char* ans) {
         }
     };
 
+    // no turn wraps more than every manipulator could, doubled while wheels may be on
+    auto lower_bound = [&pending, &bot, &grid_boosters, &booster_bag, &active_boosters] () {
+        u32 manips = bot.size() + booster_bag[BoosterManips];
+        u32 wheels = booster_bag[BoosterWheels] + active_boosters[BoosterWheels];
+        for (const auto& it : grid_boosters) {
+            if (it.second == BoosterManips) manips++;
+            if (it.second == BoosterWheels) wheels++;
+        }
+        u32 rate = wheels ? manips * 2 : manips;
+        return u32((pending.size() + rate - 1) / rate);
+    };
+
     u32 steps = 0;
 
     while (!pending.empty()) {
+        if (problem->bound && ticks + lower_bound() >= problem->bound) {
+            return 2;
+        }
+
         auto boosters = active_boosters;
         u8 did_boost = 0;
         u8 did_rotate = 0;
@@ -473,6 +599,7 @@ solve(Problem* problem, u32 ans_size, char* ans) {
                 i16 y = 0;
                 tick_with_action(Action{ActionAttachManip, x, y});
                 bot = attach_manip(bot, 0, x, y);
+                note_booster(stats, t);
                 did_boost = 1;
                 break;
             }
@@ -480,6 +607,7 @@ solve(Problem* problem, u32 ans_size, char* ans) {
                 booster_bag[it.first] -= 1;
                 tick_with_action(Action{ActionUseWheels});
                 active_boosters[t] = 50;
+                note_booster(stats, t);
                 did_boost = 1;
                 break;
             }
@@ -513,7 +641,7 @@ solve(Problem* problem, u32 ans_size, char* ans) {
             continue;
         }
 
-        auto best_closest = find_closest(bot[0], pending, grid, grid_boosters, boosters);
+        auto best_closest = find_closest(bot[0], pending, grid, grid_boosters, boosters, stats);
 
         if (best_closest.empty()) {
             break;
@@ -0,0 +1,127 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import time
+
+
+def trace(*args, **kwargs):
+    print(*args, file=sys.stderr, flush=True, **kwargs)
+
+
+IN_MODIFY = 0x2
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_Q_OVERFLOW = 0x4000
+IN_ISDIR = 0x40000000
+
+_event = struct.Struct('iIII')
+
+
+def walk_files(root):
+    for d, _, names in os.walk(root):
+        for name in names:
+            yield os.path.join(d, name)
+
+
+class Inotify:
+    # reports files once written, moved in, or found in a new directory; watches whole trees
+    def __init__(self, roots):
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self.dirs = dict()
+        self.roots = roots
+        for root in roots:
+            self.add_tree(root)
+
+    def add_tree(self, root):
+        found = list()
+        for d, _, names in os.walk(root):
+            wd = self.libc.inotify_add_watch(self.fd, os.fsencode(d), IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE)
+            if wd < 0:
+                trace(f'{d}: cannot watch, {os.strerror(ctypes.get_errno())}')
+                continue
+            self.dirs[wd] = d
+            found += [os.path.join(d, x) for x in names]
+        return found
+
+    def changes(self, timeout):
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return []
+        try:
+            data = os.read(self.fd, 1 << 16)
+        except BlockingIOError:
+            return []
+        res = list()
+        k = 0
+        while k < len(data):
+            wd, mask, _, n = _event.unpack_from(data, k)
+            name = data[k + _event.size:k + _event.size + n].rstrip(b'\0')
+            k += _event.size + n
+            if mask & IN_Q_OVERFLOW:
+                # events were lost, fall back to a rescan
+                res += [fn for root in self.roots for fn in walk_files(root)]
+                continue
+            if wd not in self.dirs: continue
+            path = os.path.join(self.dirs[wd], os.fsdecode(name))
+            if mask & IN_ISDIR:
+                # files may land before the watch does, report what is already there
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    res += self.add_tree(path)
+            elif mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+                res.append(path)
+        return res
+
+    def close(self):
+        os.close(self.fd)
+
+
+class Poller:
+    # stat walk of the watched trees, a file is reported once its size and mtime held still for a round
+    def __init__(self, roots, interval=0.5):
+        self.roots = roots
+        self.interval = interval
+        self.seen = dict()
+        self.moving = dict()
+        for root in roots:
+            for fn in walk_files(root):
+                self.seen[fn] = self.stat(fn)
+
+    def stat(self, fn):
+        try:
+            st = os.stat(fn)
+        except OSError:
+            return None
+        return (st.st_mtime_ns, st.st_size)
+
+    def changes(self, timeout):
+        time.sleep(min(timeout, self.interval))
+        res = list()
+        for root in self.roots:
+            for fn in walk_files(root):
+                st = self.stat(fn)
+                if st is None or self.seen.get(fn) == st: continue
+                if self.moving.get(fn) == st:
+                    del self.moving[fn]
+                    self.seen[fn] = st
+                    res.append(fn)
+                else:
+                    self.moving[fn] = st
+        return res
+
+    def close(self):
+        pass
+
+
+def open_watcher(roots, poll=False, interval=0.5):
+    if not poll and sys.platform.startswith('linux'):
+        try:
+            return Inotify(roots)
+        except (OSError, AttributeError) as e:
+            trace(f'{e}, falling back to polling')
+    return Poller(roots, interval=interval)